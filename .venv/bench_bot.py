@@ -0,0 +1,322 @@
+"""Офлайн-бенчмарк бота: синтетические апдейты напрямую в dp.feed_update.
+
+Бот отвечает через FakeSession (без сети), ЮKassa — FakeYooKassa на
+127.0.0.1, база — временный файл. Виртуальные пользователи параллельно
+проходят сценарии (просмотр каталога, покупка, отмена, история, админка);
+для каждого хендлера считаются p50/p95/p99 времени обработки апдейта.
+
+Хендлеры бота сами ловят исключения и отвечают «⚠️ Ошибка…», поэтому
+ошибкой апдейта считается и исключение из feed_update, и запись уровня
+ERROR в журнале во время его обработки. Сценарий покупки отдельно
+проверяет, что после «Оплатить» появился платёж.
+
+Запуск: python bench_bot.py --users 100 --duration 20 --mix browse=6,buy=2,cancel=1,history=1,admin=0.2
+Сравнение с прошлым прогоном:
+    python bench_bot.py --save baseline.json
+    python bench_bot.py --compare baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from aiogram.types import Update
+
+from fake_telegram import FakeSession
+from fake_yookassa import FakeYooKassa
+from synthetic_updates import callback_update, message_update
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+_update_errors = contextvars.ContextVar("update_errors", default=None)
+
+
+class ErrorCounter(logging.Handler):
+    """Считает записи ERROR, сделанные во время обработки текущего апдейта."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+
+    def emit(self, record):
+        errors = _update_errors.get()
+        if errors is not None:
+            errors.append(record)
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1] if len(values) > 1 else (values or [0])[0]
+
+
+class Bench:
+    """Подаёт апдейты в диспетчер и записывает задержки по хендлерам.
+
+    Какой хендлер обработал апдейт, отмечает внутренний middleware;
+    апдейты, которые не дошли ни до одного хендлера, попадают в «unhandled».
+    """
+
+    def __init__(self, main, yookassa, think=0.0):
+        self.main = main
+        self.yookassa = yookassa
+        self.think = think
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self._handled = {}
+        main.dp.message.middleware(self._track_handler)
+        main.dp.callback_query.middleware(self._track_handler)
+
+    async def _track_handler(self, handler, event, data):
+        self._handled[data["event_update"].update_id] = data["handler"].callback.__name__
+        return await handler(event, data)
+
+    async def feed(self, data):
+        update = Update.model_validate(data, context={"bot": self.main.bot})
+        logged = []
+        token = _update_errors.set(logged)
+        started = time.perf_counter()
+        try:
+            await self.main.dp.feed_update(self.main.bot, update)
+            failed = False
+        except Exception:
+            failed = True
+        finally:
+            _update_errors.reset(token)
+        elapsed = time.perf_counter() - started
+        name = self._handled.pop(update.update_id, "unhandled")
+        self.latencies[name].append(elapsed)
+        if failed or logged:
+            self.errors[name] += 1
+        if self.think:
+            await asyncio.sleep(random.expovariate(1 / self.think))
+
+
+class VirtualUser:
+    def __init__(self, bench, user_id):
+        self.bench = bench
+        self.user_id = user_id
+
+    async def message(self, text):
+        await self.bench.feed(message_update(self.user_id, text))
+
+    async def tap(self, data):
+        await self.bench.feed(callback_update(self.user_id, data))
+
+    async def state_data(self):
+        main = self.bench.main
+        return await main.dp.fsm.get_context(main.bot, chat_id=self.user_id, user_id=self.user_id).get_data()
+
+
+def pick_product(shop):
+    category_id = random.choice(list(shop))
+    return category_id, random.choice(shop[category_id])
+
+
+async def browse(user, shop):
+    category_id, product_id = pick_product(shop)
+    await user.message("/start")
+    await user.tap(f"cat_{category_id}")
+    await user.tap(f"prod_{product_id}")
+    await user.tap("back_to_main")
+
+
+async def buy(user, shop):
+    category_id, product_id = pick_product(shop)
+    await user.message("/start")
+    await user.tap(f"cat_{category_id}")
+    await user.tap(f"prod_{product_id}")
+    await user.tap("confirm_payment")
+    payment_id = (await user.state_data()).get("payment_id")
+    if not payment_id:
+        # Платёж не создан: без этой проверки сломанная оплата выглядела бы быстрее
+        user.bench.errors["buy: нет платежа"] += 1
+        return
+    await user.tap("check_payment")
+    user.bench.yookassa.set_status(payment_id, "succeeded")
+    await user.tap("check_payment")
+
+
+async def cancel(user, shop):
+    category_id, product_id = pick_product(shop)
+    await user.tap(f"cat_{category_id}")
+    await user.tap(f"prod_{product_id}")
+    await user.tap("confirm_payment")
+    await user.tap("cancel_payment")
+
+
+async def history(user, shop):
+    await user.message("/history")
+    purchases, _, has_older = await user.bench.main.repo.get_purchase_history(user.user_id)
+    if has_older:
+        await user.tap(f"hist_older_{purchases[-1][0]}")
+
+
+async def admin(user, shop):
+    category_id, _ = pick_product(shop)
+    await user.message("/admin")
+    await user.message("Просмотреть остатки")
+    await user.message("Добавить товар")
+    await user.tap("existing_category")
+    await user.tap(f"existing_cat_{category_id}")
+    await user.message(f"Бенчмарк {user.user_id}-{random.randrange(10 ** 9)}")
+    await user.message("Описание")
+    await user.message("100")
+    await user.message("1000")
+    await user.message("нет")
+    await user.message("Выйти из админки")
+
+
+SCENARIOS = {"browse": browse, "buy": buy, "cancel": cancel, "history": history, "admin": admin}
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        name, _, weight = item.partition("=")
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name}, есть: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def run_user(bench, user_id, shop, args, deadline):
+    user = VirtualUser(bench, user_id)
+    names, weights = list(args.mix), list(args.mix.values())
+    iterations = 0
+    while time.monotonic() < deadline and (not args.iterations or iterations < args.iterations):
+        await SCENARIOS[random.choices(names, weights)[0]](user, shop)
+        iterations += 1
+
+
+def report(bench, elapsed):
+    total = sum(len(values) for values in bench.latencies.values())
+    errors = sum(bench.errors.values())
+    result = {"updates": total, "throughput": total / elapsed, "errors": errors, "handlers": {}}
+    print(f"{'хендлер':<28}{'апдейтов':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'макс мс':>10}{'ошибок':>8}")
+    for name, values in sorted(bench.latencies.items(), key=lambda item: -len(item[1])):
+        ms = [value * 1000 for value in values]
+        stats = {
+            "count": len(ms), "errors": bench.errors[name],
+            "p50": percentile(ms, 50), "p95": percentile(ms, 95), "p99": percentile(ms, 99)
+        }
+        result["handlers"][name] = stats
+        print(f"{name:<28}{len(ms):>10}{stats['p50']:>10.2f}{stats['p95']:>10.2f}{stats['p99']:>10.2f}"
+              f"{max(ms):>10.2f}{bench.errors[name]:>8}")
+    for name, count in bench.errors.items():
+        if name not in bench.latencies:
+            print(f"{name:<28}{'':>50}{count:>8}")
+    print(f"всего: {total} апдейтов за {elapsed:.1f} с, {result['throughput']:.0f} апдейтов/с, ошибок: {errors}")
+    return result
+
+
+def compare(result, baseline, tolerance):
+    """Сравнить с сохранённым прогоном. Возвращает список регрессий."""
+    regressions = []
+    if result["errors"] > baseline.get("errors", 0):
+        regressions.append(f"ошибок {result['errors']} > {baseline.get('errors', 0)}")
+    if result["throughput"] < baseline["throughput"] * (1 - tolerance):
+        regressions.append(f"пропускная способность {result['throughput']:.0f} < {baseline['throughput']:.0f}")
+    for name, stats in result["handlers"].items():
+        base = baseline["handlers"].get(name)
+        if base and stats["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {stats['p95']:.2f} мс > {base['p95']:.2f} мс")
+    return regressions
+
+
+async def run(main, yookassa, args):
+    user_ids = list(range(100001, 100001 + args.users))
+    main.ADMIN_IDS.extend(user_ids)
+    await main.db.execute("UPDATE products SET stock = ?", (args.stock,))
+    main.catalog.clear()
+    shop = {}
+    for category_id, _ in await main.repo.get_categories():
+        shop[category_id] = [product[0] for product in await main.repo.get_category_products(category_id)]
+
+    bench = Bench(main, yookassa, args.think)
+    if args.warmup:
+        await asyncio.gather(*(run_user(bench, user_id, shop, args, time.monotonic() + args.warmup)
+                               for user_id in user_ids))
+        bench.latencies.clear()
+        bench.errors.clear()
+
+    started = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    await asyncio.gather(*(run_user(bench, user_id, shop, args, deadline) for user_id in user_ids))
+    result = report(bench, time.perf_counter() - started)
+    print(f"вызовов Telegram API: {sum(main.bot.session.calls.values())}, "
+          f"запросов к ЮKassa: {yookassa.requests}, кэш каталога: {main.catalog.stats()}")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"⚠️ регрессия: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50, help="одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=10, help="длительность замера, с")
+    parser.add_argument("--iterations", type=int, default=0, help="сценариев на пользователя (0 — без ограничения)")
+    parser.add_argument("--warmup", type=float, default=1, help="прогрев перед замером, с")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("browse=6,buy=2,cancel=1,history=1,admin=0.2"))
+    parser.add_argument("--think", type=float, default=0.0, help="средняя пауза пользователя между действиями, с")
+    parser.add_argument("--stock", type=int, default=1000000)
+    parser.add_argument("--telegram-latency", type=float, default=0.0)
+    parser.add_argument("--yookassa-latency", type=float, default=0.02)
+    parser.add_argument("--yookassa-fail-rate", type=float, default=0.0, help="доля ответов 503 от ЮKassa")
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--compare", help="сравнить с сохранённым JSON, код выхода 1 при регрессии")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yookassa = FakeYooKassa(args.yookassa_latency, args.yookassa_fail_rate)
+    yookassa_url = loop.run_until_complete(yookassa.start(port=free_port()))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            BOT_TOKEN="123456:BENCH",
+            YOOKASSA_SHOP_ID="bench",
+            YOOKASSA_SECRET_KEY="bench",
+            YOOKASSA_API_URL=yookassa_url,
+            PAYMENT_CHECK_INTERVAL="0",
+            DB_PATH=os.path.join(tmp, "shop.db"),
+            DB_POOL_SIZE=str(args.pool_size)
+        )
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main as bot_main
+        # Журнал каждого апдейта на INFO искажает замер
+        logging.getLogger().setLevel(logging.WARNING)
+        logging.getLogger().addHandler(ErrorCounter())
+        bot_main.bot.session = FakeSession(args.telegram_latency)
+        try:
+            return loop.run_until_complete(run(bot_main, yookassa, args))
+        finally:
+            loop.run_until_complete(bot_main.yookassa.close())
+            loop.run_until_complete(yookassa.close())
+            bot_main.db.close()
+            loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
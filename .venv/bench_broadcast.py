@@ -0,0 +1,131 @@
+"""Рассылка и уведомления о поступлении через очередь outbox против лимитов Telegram.
+
+Поддельный Telegram принимает rate-limit sendMessage в секунду и не чаще
+раза в секунду в один чат, сверх этого отвечает 429. Сначала сообщения
+шлются напрямую, без планировщика, затем через Notifier: подписчики
+товара получают уведомление о пополнении, все пользователи — рассылку.
+На середине отправки Notifier останавливается и запускается заново,
+как после перезапуска процесса.
+
+Запуск: python bench_broadcast.py --users 1500 --rate-limit 30
+"""
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def send_directly(main, users, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    failures = 0
+
+    async def send(chat_id):
+        nonlocal failures
+        async with semaphore:
+            try:
+                await main.bot.send_message(chat_id, "без очереди")
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(chat_id) for chat_id in users))
+    return time.perf_counter() - started, failures
+
+
+async def run(main, telegram, args):
+    users = list(range(1, args.users + 1))
+    blocked = set(users[::50])
+    telegram.blocked = blocked
+
+    elapsed, failures = await send_directly(main, users[:args.direct], 20)
+    print(f"без планировщика: {args.direct} сообщений за {elapsed:.1f} с, отказов {failures} "
+          f"(429: {telegram.throttled})")
+    telegram.sent.clear()
+    telegram.throttled = 0
+    await asyncio.sleep(1.5)
+
+    product_id, category_id = await main.repo.add_product("🔔 Тест", "Хит", "", 100, None, 0)
+    for user_id in users:
+        await main.repo.register_user(user_id)
+        if user_id % 2:
+            await main.repo.subscribe_restock(user_id, product_id)
+    await main.repo.restock_category(category_id, 10)
+    started = time.perf_counter()
+    restock = await main.repo.queue_restock_notifications(category_id, "🔔 Снова в наличии: {name}")
+    broadcast = await main.repo.queue_broadcast("📣 Рассылка")
+    print(f"в очереди: уведомлений {restock}, рассылка {broadcast}, "
+          f"поставлено за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    total = restock + broadcast
+    started = time.perf_counter()
+    for stage in range(2):
+        notifier = main.Notifier(main.repo, main.send_outbox_message, rate=args.rate, poll_interval=0.2)
+        task = asyncio.create_task(notifier.run())
+        while await main.repo.count_outbox_pending():
+            if stage == 0 and len(telegram.sent) >= total // 3:
+                break
+            await asyncio.sleep(0.2)
+        task.cancel()
+        if stage == 0:
+            print(f"остановка после {len(telegram.sent)} сообщений, перезапуск")
+    elapsed = time.perf_counter() - started
+
+    delivered = Counter(telegram.sent)
+    duplicates = sum(count - 1 for count in delivered.values())
+    expected_restock = len([u for u in users if u % 2 and u not in blocked])
+    failed = (await main.db.fetchone("SELECT COUNT(*) FROM outbox WHERE status = 'failed'"))[0]
+    print(f"через очередь: {len(telegram.sent)} сообщений за {elapsed:.1f} с, "
+          f"{len(telegram.sent) / elapsed:.1f} сообщений/с, 429: {telegram.throttled}")
+    print(f"уведомлений доставлено: {sum(1 for chat, text in delivered if text.startswith('🔔'))} "
+          f"из {expected_restock}, дублей: {duplicates}, не доставлено (бот заблокирован): {failed}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1500)
+    parser.add_argument("--rate-limit", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=25)
+    parser.add_argument("--direct", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_telegram import FakeTelegram
+
+    async def start():
+        telegram = FakeTelegram(args.latency, args.rate_limit, chat_interval=1)
+        return telegram, await telegram.start(port=free_port())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        loop = asyncio.new_event_loop()
+        telegram, url = loop.run_until_complete(start())
+        os.environ.update(
+            BOT_TOKEN="123456:BENCH",
+            YOOKASSA_SHOP_ID="bench",
+            YOOKASSA_SECRET_KEY="bench",
+            TELEGRAM_API_URL=url,
+            DB_PATH=os.path.join(tmp, "shop.db")
+        )
+        import main as bot_main
+        try:
+            return loop.run_until_complete(run(bot_main, telegram, args))
+        finally:
+            loop.run_until_complete(bot_main.bot.session.close())
+            loop.run_until_complete(telegram.close())
+            bot_main.db.close()
+            loop.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Сравнение старого доступа к базе (connect/close в каждом хендлере) с пулом Database.
+
+Оба прогона идут по одной и той же мигрированной схеме и одним и тем же
+запросам, поэтому разница — только в работе с соединениями. Влияние
+индексов меряет bench_history.py.
+
+Запуск: python bench_db.py --updates 5000 --concurrency 100
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import uuid
+
+from db import Database
+from migrations import migrate
+from repository import ShopRepository
+
+
+def prepare_db(path, products=200, purchases=50000, users=1000):
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(f"cat{i}",) for i in range(10)])
+    conn.executemany(
+        "INSERT INTO products (category_id, name, description, price, promo_code, stock) VALUES (?, ?, ?, ?, ?, ?)",
+        [(i % 10 + 1, f"product{i}", "desc", 100 + i, f"PROMO{i}", 10 ** 6) for i in range(products)]
+    )
+    conn.executemany(
+        "INSERT INTO purchases (user_id, product_id) VALUES (?, ?)",
+        [(random.randrange(users), random.randrange(1, products + 1)) for _ in range(purchases)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def blocking_update(path, user_id, product_id, buy):
+    """Один апдейт в старом стиле: каждый запрос открывает своё соединение."""
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "SELECT c.id, c.name FROM categories c "
+        "WHERE EXISTS (SELECT 1 FROM products p WHERE p.category_id = c.id) ORDER BY c.id"
+    ).fetchall()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "SELECT id, name, price, stock FROM products WHERE category_id = ? AND id > ? ORDER BY id LIMIT ?",
+        (product_id % 10 + 1, 0, 11)
+    ).fetchall()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute("SELECT name, description, price, stock FROM products WHERE id = ?", (product_id,)).fetchone()
+    conn.close()
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        SELECT pu.id, p.name, c.name, p.price, pu.purchase_date
+        FROM purchases pu
+        JOIN products p ON pu.product_id = p.id
+        JOIN categories c ON p.category_id = c.id
+        WHERE pu.user_id = ? ORDER BY pu.purchase_date DESC, pu.id DESC LIMIT 11
+    ''', (user_id,)).fetchall()
+    conn.close()
+    if buy:
+        payment_id = str(uuid.uuid4())
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "INSERT INTO payments (payment_id, user_id, product_id, amount) VALUES (?, ?, ?, ?)",
+            (payment_id, user_id, product_id, 100)
+        )
+        conn.commit()
+        conn.close()
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE products SET stock = stock - 1 WHERE id = ? AND stock > 0", (product_id,))
+        cursor = conn.execute("INSERT INTO purchases (user_id, product_id) VALUES (?, ?)", (user_id, product_id))
+        conn.execute(
+            "UPDATE payments SET status = 'succeeded', purchase_id = ? WHERE payment_id = ?",
+            (cursor.lastrowid, payment_id)
+        )
+        conn.commit()
+        conn.close()
+
+
+async def pooled_update(repo, user_id, product_id, buy):
+    await repo.get_categories(include_empty=True)
+    await repo.get_category_page(product_id % 10 + 1)
+    await repo.get_product(product_id)
+    await repo.get_purchase_history(user_id)
+    if buy:
+        payment_id = str(uuid.uuid4())
+        await repo.create_payment_record(payment_id, user_id, product_id, 100)
+        await repo.fulfil_payment(payment_id)
+
+
+async def heartbeat(stop, lags):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(name, make_update, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stop = asyncio.Event()
+    lags = []
+    monitor = asyncio.create_task(heartbeat(stop, lags))
+
+    async def one():
+        async with semaphore:
+            await make_update(random.randrange(1000), random.randrange(1, 201), random.random() < args.write_ratio)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.updates)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+    print(f"{name:>8}: {args.updates / elapsed:8.0f} updates/s, "
+          f"максимальная задержка event loop {max(lags, default=0) * 1000:.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--write-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        prepare_db(path)
+
+        async def before(user_id, product_id, buy):
+            blocking_update(path, user_id, product_id, buy)
+
+        await run("before", before, args)
+
+        db = Database(path, pool_size=args.pool_size)
+        repo = ShopRepository(db)
+
+        async def after(user_id, product_id, buy):
+            await pooled_update(repo, user_id, product_id, buy)
+
+        await run("after", after, args)
+        db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
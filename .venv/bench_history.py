@@ -0,0 +1,109 @@
+"""Запросы истории покупок и каталога на синтетической базе с миллионами покупок.
+
+Сравнивает схему до индексов (миграция 2) и после (миграция 3), а также
+постраничный вывод через OFFSET и по ключу (keyset).
+
+Запуск: python bench_history.py --purchases 2000000 --users 20000 --products 5000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from migrations import migrate
+
+
+HISTORY = '''
+    SELECT pu.id, p.name, c.name, p.price, pu.purchase_date
+    FROM purchases pu
+    JOIN products p ON pu.product_id = p.id
+    JOIN categories c ON p.category_id = c.id
+    WHERE pu.user_id = ? {condition}
+    ORDER BY pu.purchase_date DESC, pu.id DESC
+    LIMIT 10 {offset}
+'''
+KEYSET = "AND (pu.purchase_date, pu.id) < (SELECT purchase_date, id FROM purchases WHERE id = ?)"
+CATEGORY_PAGE = "SELECT id, name, price, stock FROM products WHERE category_id = ? AND id > ? ORDER BY id LIMIT 11"
+EMPTY_CATEGORIES = '''
+    SELECT c.id, c.name FROM categories c
+    JOIN products p ON p.category_id = c.id
+    GROUP BY c.id HAVING MAX(p.stock) <= 0
+'''
+
+
+def prepare_db(path, args):
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn, target=2)
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO categories (name) VALUES (?)", [(f"cat{i}",) for i in range(args.categories)])
+    conn.executemany(
+        "INSERT INTO products (category_id, name, description, price, stock) VALUES (?, ?, '', ?, ?)",
+        [(i % args.categories + 1, f"product{i}", 100 + i % 900, random.randrange(0, 20))
+         for i in range(args.products)]
+    )
+    started = time.time() - 365 * 86400
+    conn.executemany(
+        "INSERT INTO purchases (user_id, product_id, purchase_date) "
+        "VALUES (?, ?, datetime(?, 'unixepoch'))",
+        ((random.randrange(args.users), random.randrange(1, args.products + 1),
+          started + i * 365 * 86400 / args.purchases) for i in range(args.purchases))
+    )
+    conn.commit()
+    return conn
+
+
+def measure(conn, name, query, params_list):
+    started = time.perf_counter()
+    for params in params_list:
+        conn.execute(query, params).fetchall()
+    elapsed = (time.perf_counter() - started) / len(params_list)
+    print(f"  {name:<40} {elapsed * 1000:9.3f} мс")
+
+
+def run_suite(conn, args):
+    users = [random.randrange(args.users) for _ in range(args.samples)]
+    deep = args.purchases // args.users // 2
+    cursors = []
+    for user_id in users:
+        row = conn.execute(
+            "SELECT id FROM purchases WHERE user_id = ? ORDER BY purchase_date DESC, id DESC LIMIT 1 OFFSET ?",
+            (user_id, max(deep - 1, 0))
+        ).fetchone()
+        cursors.append((user_id, row[0] if row else 0))
+    measure(conn, "история: первая страница", HISTORY.format(condition="", offset=""), [(u,) for u in users])
+    measure(conn, f"история: страница через OFFSET {deep}",
+            HISTORY.format(condition="", offset=f"OFFSET {deep}"), [(u,) for u in users])
+    measure(conn, "история: та же страница по ключу", HISTORY.format(condition=KEYSET, offset=""), cursors)
+    categories = [(random.randrange(1, args.categories + 1), 0) for _ in range(args.samples)]
+    measure(conn, "каталог: страница категории", CATEGORY_PAGE, categories)
+    measure(conn, "админка: пустые категории", EMPTY_CATEGORIES, [()] * max(args.samples // 10, 1))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--purchases", type=int, default=2000000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "history.db")
+        started = time.perf_counter()
+        conn = prepare_db(path, args)
+        print(f"база: {args.purchases} покупок, {args.products} товаров, "
+              f"заполнена за {time.perf_counter() - started:.1f} с")
+        print("без индексов (миграция 2):")
+        run_suite(conn, args)
+        started = time.perf_counter()
+        migrate(conn, target=3)
+        print(f"с индексами (миграция 3, построены за {time.perf_counter() - started:.1f} с):")
+        run_suite(conn, args)
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
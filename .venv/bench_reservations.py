@@ -0,0 +1,120 @@
+"""Флеш-распродажа: сотни одновременных покупателей на товар с маленьким остатком.
+
+Каждый покупатель резервирует единицу, половина успешных оплачивает,
+остальные бросают оплату, и их резервы снимаются по TTL. Затем приходит
+вторая волна. Каждый покупатель жмёт «Оплатить» --repeat раз одновременно,
+и все нажатия должны получить один и тот же резерв. В конце проверяется,
+что продано не больше, чем было, ни один код не выдан дважды и ни у кого
+не было второго резерва.
+
+Запуск: python bench_reservations.py --buyers 500 --stock 20 --pool-size 8 --repeat 2
+"""
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else (values or [0])[0]
+
+
+async def wave(main, product_id, buyers, ttl, repeat, latencies, errors):
+    paid = extra_holds = 0
+
+    async def tap(user_id):
+        started = time.perf_counter()
+        try:
+            return await main.repo.hold_unit(user_id, product_id, ttl)
+        except sqlite3.OperationalError:
+            errors.append(user_id)
+        finally:
+            latencies.append(time.perf_counter() - started)
+
+    async def buyer(user_id):
+        nonlocal paid, extra_holds
+        holds = [hold for hold in await asyncio.gather(*(tap(user_id) for _ in range(repeat))) if hold]
+        extra_holds += len({hold[0] for hold in holds}) - 1 if holds else 0
+        if not holds:
+            return
+        hold = holds[0]
+        payment_id = str(uuid.uuid4())
+        await main.repo.create_payment_record(payment_id, user_id, product_id, 100, hold[0])
+        await asyncio.sleep(random.random() * 0.05)
+        if random.random() < 0.5:
+            _, order, _ = await main.repo.fulfil_payment(payment_id)
+            if order.status == "succeeded":
+                paid += 1
+
+    await asyncio.gather(*(buyer(user_id) for user_id in range(buyers)))
+    return paid, extra_holds
+
+
+async def run(main, args):
+    codes = [f"FLASH-{i:05d}" for i in range(args.stock)]
+    product_id, _ = await main.repo.add_product("⚡ Распродажа", "Флеш", "", 100, None, args.stock, codes)
+    latencies, errors = [], []
+    paid = extra_holds = 0
+    for _ in range(args.waves):
+        wave_paid, wave_extra = await wave(main, product_id, args.buyers, args.ttl, args.repeat, latencies, errors)
+        paid += wave_paid
+        extra_holds += wave_extra
+        await asyncio.sleep(args.ttl)
+        await main.repo.release_expired_reservations()
+
+    stock = (await main.db.fetchone("SELECT stock FROM products WHERE id = ?", (product_id,)))[0]
+    sold, held, purchases, distinct_codes = await main.db.fetchone('''
+        SELECT
+            (SELECT COUNT(*) FROM promo_codes WHERE product_id = ? AND status = 'sold'),
+            (SELECT COUNT(*) FROM promo_codes WHERE product_id = ? AND status = 'held'),
+            (SELECT COUNT(*) FROM purchases WHERE product_id = ?),
+            (SELECT COUNT(DISTINCT r.code_id) FROM reservations r WHERE r.product_id = ? AND r.status = 'purchased')
+    ''', (product_id,) * 4)
+    latencies_ms = [value * 1000 for value in latencies]
+    print(f"покупателей: {args.buyers * args.waves}, остаток: {args.stock}, оплачено: {paid}")
+    print(f"продано кодов: {sold}, покупок: {purchases}, уникальных кодов в покупках: {distinct_codes}")
+    print(f"на складе: {stock}, в резерве: {held}, ошибок блокировки: {len(errors)}, "
+          f"лишних резервов у повторных покупателей: {extra_holds}")
+    print(f"резервирование: p50 {percentile(latencies_ms, 50):.1f} мс, "
+          f"p95 {percentile(latencies_ms, 95):.1f} мс, p99 {percentile(latencies_ms, 99):.1f} мс")
+    oversold = purchases > args.stock or sold != purchases or distinct_codes != purchases
+    leaked = stock + held + sold != args.stock
+    violated = oversold or leaked or extra_holds
+    print("перепродаж нет" if not violated else "⚠️ НАРУШЕНИЕ ИНВАРИАНТОВ")
+    return 1 if violated else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--stock", type=int, default=20)
+    parser.add_argument("--waves", type=int, default=2)
+    parser.add_argument("--ttl", type=float, default=0.5)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=2, help="одновременных нажатий «Оплатить» на покупателя")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(
+            BOT_TOKEN="123456:BENCH",
+            YOOKASSA_SHOP_ID="bench",
+            YOOKASSA_SECRET_KEY="bench",
+            DB_PATH=os.path.join(tmp, "shop.db"),
+            DB_POOL_SIZE=str(args.pool_size)
+        )
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        import main as bot_main
+        try:
+            return asyncio.run(run(bot_main, args))
+        finally:
+            bot_main.db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Нагрузочный тест режима вебхука: пропускная способность в зависимости от числа процессов.
+
+Запускает поддельный Telegram API, затем main.py с RUN_MODE=webhook и
+WEB_WORKERS=1, 2, 4 ... и шлёт синтетические апдейты в общий порт.
+Апдейты обрабатываются синхронно (WEBHOOK_IN_BACKGROUND=0), поэтому
+ответ на запрос означает, что хендлер отработал.
+
+Запуск: python bench_webhook.py --workers 1 2 4 --updates 4000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from synthetic_updates import callback_update, message_update
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TOKEN = "123456:BENCH"
+SCENARIO = ["/start", "cat_1", "prod_1", "cancel_payment", "cat_2", "prod_3", "back_to_main"]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise TimeoutError(f"порт {port} не открылся")
+
+
+def make_update(user_id, step):
+    action = SCENARIO[step % len(SCENARIO)]
+    return message_update(user_id, action) if action.startswith("/") else callback_update(user_id, action)
+
+
+async def load(port, updates, concurrency, users):
+    url = f"http://127.0.0.1:{port}/telegram/webhook"
+    steps = {}
+    queue = asyncio.Queue()
+    for _ in range(updates):
+        queue.put_nowait(random.randrange(users))
+    errors = 0
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+        async def client():
+            nonlocal errors
+            while not queue.empty():
+                user_id = queue.get_nowait() + 1
+                step = steps.get(user_id, 0)
+                steps[user_id] = step + 1
+                async with session.post(url, json=make_update(user_id, step)) as response:
+                    if response.status != 200:
+                        errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return time.perf_counter() - started, errors
+
+
+async def run(workers, args, telegram_url, tmp):
+    port = free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN,
+        YOOKASSA_SHOP_ID="bench",
+        YOOKASSA_SECRET_KEY="bench",
+        TELEGRAM_API_URL=telegram_url,
+        DB_PATH=os.path.join(tmp, f"shop-{workers}.db"),
+        RUN_MODE="webhook",
+        WEB_WORKERS=str(workers),
+        WEBHOOK_IN_BACKGROUND="0",
+        HTTP_HOST="127.0.0.1",
+        HTTP_PORT=str(port)
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "main.py")],
+        env=env, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        await wait_for_port(port)
+        await asyncio.sleep(1)
+        await load(port, min(500, args.updates), args.concurrency, args.users)
+        elapsed, errors = await load(port, args.updates, args.concurrency, args.users)
+    finally:
+        process.terminate()
+        process.wait()
+    print(f"процессов: {workers}  {args.updates / elapsed:8.0f} updates/s  ошибок: {errors}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    telegram_port = free_port()
+    telegram = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "fake_telegram.py"), "--port", str(telegram_port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        await wait_for_port(telegram_port)
+        with tempfile.TemporaryDirectory() as tmp:
+            for workers in args.workers:
+                await run(workers, args, f"http://127.0.0.1:{telegram_port}", tmp)
+    finally:
+        telegram.terminate()
+        telegram.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class CatalogCache:
+    """LRU-кэш каталога с TTL, счётчиками попаданий и точечной инвалидацией.
+
+    Ключи — кортежи: ("categories", include_empty), ("main_kb",),
+    ("products", category_id), ("products_kb", category_id, ...), ("product", product_id).
+    Одновременные промахи по одному ключу делят одну загрузку; если ключ
+    инвалидирован, пока его загрузка идёт, результат отдаётся ждущим, но не
+    кэшируется. Загрузки других ключей это не затрагивает.
+
+    sync — корутина, возвращающая общий для процессов номер версии каталога
+    (repository.get_catalog_version). Если он задан, версия сверяется не чаще
+    раза в sync_interval секунд, и при её смене кэш сбрасывается целиком:
+    так процесс узнаёт об изменениях, сделанных другими процессами.
+    """
+
+    def __init__(self, ttl=300, max_size=512, sync=None, sync_interval=1.0):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self._shared_version = None
+        self._next_sync = 0.0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._loading = {}
+        self._stale = set()
+
+    async def _sync(self):
+        now = time.monotonic()
+        if now < self._next_sync:
+            return
+        self._next_sync = now + self.sync_interval
+        version = await self.sync()
+        if version != self._shared_version:
+            self._shared_version = version
+            self.clear()
+
+    async def get(self, key, loader):
+        if self.sync is not None:
+            await self._sync()
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        future = self._loading.get(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            value = await loader()
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            del self._loading[key]
+            stale = key in self._stale
+            self._stale.discard(key)
+        future.set_result(value)
+        # Если во время загрузки ключ инвалидировали, результат мог устареть
+        if not stale:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return value
+
+    def _drop(self, predicate):
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+        self._stale.update(key for key in self._loading if predicate(key))
+
+    def category_changed(self, category_id):
+        """Товар добавлен, удалён или пополнен в категории."""
+        self._drop(lambda key: key[0] in ("categories", "main_kb", "product")
+                   or (key[0] in ("products", "products_kb") and key[1] == category_id))
+
+    def product_changed(self, product_id, category_id, crossed_zero=False):
+        """Изменился остаток одного товара (резерв, покупка, отмена).
+
+        Список категорий в наличии, ("categories", False), меняется, только
+        когда остаток перешёл через ноль; главное меню и полный список
+        категорий от остатков не зависят.
+        """
+        self._drop(lambda key: (key[0] in ("products", "products_kb") and key[1] == category_id)
+                   or (key[0] == "product" and key[1] == product_id)
+                   or (crossed_zero and key == ("categories", False)))
+
+    def clear(self):
+        self._drop(lambda key: True)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
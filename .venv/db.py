@@ -0,0 +1,130 @@
+import asyncio
+import functools
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_ERRORS, observe_query
+
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA mmap_size=67108864",
+)
+
+_STATEMENT = re.compile(r"\s*(?:(SELECT|DELETE)\b.*?\bFROM|(INSERT)\b.*?\bINTO|(UPDATE))\s+(\w+)", re.S | re.I)
+
+
+@functools.lru_cache(maxsize=1024)
+def query_label(query):
+    """Короткая метка запроса для метрик: «select products», «update payments»."""
+    match = _STATEMENT.match(query)
+    if match is None:
+        return query.split(None, 1)[0].lower() if query.strip() else "empty"
+    verb = next(group for group in match.groups()[:3] if group)
+    return f"{verb.lower()} {match.group(4)}"
+
+
+class Database:
+    """Пул долгоживущих соединений SQLite.
+
+    Каждый поток исполнителя владеет своим соединением, поэтому запросы
+    не блокируют event loop и не платят за connect/close на каждый апдейт.
+    Подготовленные выражения кэшируются самим sqlite3 (cached_statements).
+    """
+
+    def __init__(self, path, pool_size=4, busy_timeout=5000, cached_statements=256):
+        self.path = path
+        self.pool_size = pool_size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout / 1000,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=self.cached_statements
+        )
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self.connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _call(self, func, args):
+        return func(self._connection(), *args)
+
+    def _call_in_transaction(self, func, args):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn, *args)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _timed(call, func, args):
+        started = time.perf_counter()
+        return call(func, args), started, time.perf_counter()
+
+    async def _submit(self, call, func, args, label):
+        # Время ожидания потока и время самого запроса пишутся в метрики отдельно
+        loop = asyncio.get_running_loop()
+        label = label or func.__name__.lstrip("_")
+        submitted = time.perf_counter()
+        try:
+            result, started, finished = await loop.run_in_executor(self._executor, self._timed, call, func, args)
+        except Exception:
+            DB_ERRORS.inc(label)
+            raise
+        observe_query(label, started - submitted, finished - started)
+        return result
+
+    async def run(self, func, *args, label=None):
+        """Выполнить func(conn, *args) в потоке пула."""
+        return await self._submit(self._call, func, args, label)
+
+    async def transaction(self, func, *args, label=None):
+        """Выполнить func(conn, *args) внутри BEGIN IMMEDIATE ... COMMIT."""
+        return await self._submit(self._call_in_transaction, func, args, label)
+
+    async def fetchone(self, query, params=()):
+        return await self.run(lambda conn: conn.execute(query, params).fetchone(), label=query_label(query))
+
+    async def fetchall(self, query, params=()):
+        return await self.run(lambda conn: conn.execute(query, params).fetchall(), label=query_label(query))
+
+    async def execute(self, query, params=()):
+        def _execute(conn):
+            cursor = conn.execute(query, params)
+            return cursor.rowcount, cursor.lastrowid
+        return await self.run(_execute, label=query_label(query))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,144 @@
+"""Локальная имитация Telegram Bot API для нагрузочных тестов.
+
+Запуск: python fake_telegram.py --port 8082
+Затем TELEGRAM_API_URL=http://127.0.0.1:8082
+
+FakeSession — то же самое без HTTP, для Bot(session=FakeSession()) в одном процессе.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from aiogram.client.session.base import BaseSession
+from aiohttp import web
+
+
+MESSAGE_METHODS = {"sendMessage", "editMessageText", "editMessageReplyMarkup", "sendPhoto"}
+
+
+def message_result(message_id, chat_id, text):
+    return {
+        "message_id": message_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": text or ""
+    }
+
+
+class FakeTelegram:
+    """Отвечает успехом на любой метод и считает вызовы.
+
+    rate_limit — сколько sendMessage в секунду принимается от бота целиком,
+    chat_interval — как часто можно писать в один чат. Сверх лимита
+    отвечает 429 с retry_after, как настоящий API. В чаты из blocked — 403.
+    """
+
+    def __init__(self, latency=0.0, rate_limit=None, chat_interval=None, blocked=()):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.chat_interval = chat_interval
+        self.blocked = set(blocked)
+        self.calls = {}
+        self.sent = []
+        self.throttled = 0
+        self._window = (0, 0)
+        self._chat_sent = {}
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        data = await request.post()
+        chat_id = int(data.get("chat_id") or 1)
+        if method not in MESSAGE_METHODS:
+            return web.json_response({"ok": True, "result": True})
+        if method == "sendMessage":
+            if chat_id in self.blocked:
+                return web.json_response({
+                    "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"
+                }, status=403)
+            retry_after = self._retry_after(chat_id)
+            if retry_after:
+                self.throttled += 1
+                return web.json_response({
+                    "ok": False, "error_code": 429,
+                    "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}
+                }, status=429)
+            self.sent.append((chat_id, data.get("text")))
+        return web.json_response({"ok": True, "result": message_result(len(self.sent) + 1, chat_id, data.get("text"))})
+
+    def _retry_after(self, chat_id):
+        now = time.monotonic()
+        if self.chat_interval and now - self._chat_sent.get(chat_id, -self.chat_interval) < self.chat_interval:
+            return 1
+        if self.rate_limit:
+            second, count = self._window
+            if int(now) != second:
+                second, count = int(now), 0
+            if count >= self.rate_limit:
+                return 1
+            self._window = (second, count + 1)
+        self._chat_sent[chat_id] = now
+        return 0
+
+    async def start(self, host="127.0.0.1", port=8082):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+class FakeSession(BaseSession):
+    """Сессия aiogram, которая отвечает успехом без сети.
+
+    Ответ проходит обычный разбор check_response, поэтому стоимость
+    десериализации та же, что с настоящим API.
+    """
+
+    def __init__(self, latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = {}
+        self.sent = []
+
+    async def make_request(self, bot, method, timeout=None):
+        name = method.__api_method__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = True
+        if name in MESSAGE_METHODS:
+            chat_id = getattr(method, "chat_id", None) or 1
+            text = getattr(method, "text", None)
+            if name == "sendMessage":
+                self.sent.append((chat_id, text))
+            result = message_result(len(self.sent) + 1, chat_id, text)
+        return self.check_response(bot, method, 200, json.dumps({"ok": True, "result": result})).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit", type=int)
+    parser.add_argument("--chat-interval", type=float)
+    args = parser.parse_args()
+    telegram = FakeTelegram(args.latency, args.rate_limit, args.chat_interval)
+    web.run_app(telegram.app, host=args.host, port=args.port, access_log=None)
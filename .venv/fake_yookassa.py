@@ -0,0 +1,111 @@
+"""Локальная имитация API ЮKassa для тестов и бенчмарков.
+
+Запуск: python fake_yookassa.py --port 8081 --latency 0.2 --fail-rate 0.1
+Затем YOOKASSA_API_URL=http://127.0.0.1:8081/v3
+"""
+import argparse
+import asyncio
+import random
+import uuid
+
+from aiohttp import web
+
+
+class FakeYooKassa:
+    """Хранит платежи в памяти, поддерживает Idempotence-Key, задержку и сбои.
+
+    Статус платежа меняется через set_status() или
+    POST /fake/payments/{id}/{status}. При auto_succeed платёж
+    сразу считается оплаченным. fail_next — сколько ближайших запросов
+    ответить 503 независимо от fail_rate.
+    """
+
+    def __init__(self, latency=0.0, fail_rate=0.0, auto_succeed=False, fail_next=0):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.auto_succeed = auto_succeed
+        self.fail_next = fail_next
+        self.payments = {}
+        self.idempotence_keys = {}
+        self.received_keys = []
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_post("/v3/payments", self.create_payment)
+        self.app.router.add_get("/v3/payments/{payment_id}", self.get_payment)
+        self.app.router.add_post("/fake/payments/{payment_id}/{status}", self.change_status)
+        self._runner = None
+
+    async def _simulate(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_next:
+            self.fail_next -= 1
+            raise web.HTTPServiceUnavailable(text='{"type": "error", "code": "internal_server_error"}')
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise web.HTTPServiceUnavailable(text='{"type": "error", "code": "internal_server_error"}')
+
+    async def create_payment(self, request):
+        key = request.headers.get("Idempotence-Key")
+        self.received_keys.append(key)
+        await self._simulate()
+        if key in self.idempotence_keys:
+            return web.json_response(self.payments[self.idempotence_keys[key]])
+        body = await request.json()
+        payment_id = str(uuid.uuid4())
+        self.payments[payment_id] = {
+            "id": payment_id,
+            "status": "succeeded" if self.auto_succeed else "pending",
+            "paid": self.auto_succeed,
+            "amount": body["amount"],
+            "description": body.get("description"),
+            "metadata": body.get("metadata", {}),
+            "confirmation": {
+                "type": "redirect",
+                "confirmation_url": f"https://yoomoney.example/checkout/{payment_id}"
+            }
+        }
+        if key:
+            self.idempotence_keys[key] = payment_id
+        return web.json_response(self.payments[payment_id])
+
+    async def get_payment(self, request):
+        await self._simulate()
+        payment = self.payments.get(request.match_info["payment_id"])
+        if payment is None:
+            raise web.HTTPNotFound(text='{"type": "error", "code": "not_found"}')
+        return web.json_response(payment)
+
+    async def change_status(self, request):
+        payment_id = request.match_info["payment_id"]
+        if payment_id not in self.payments:
+            raise web.HTTPNotFound()
+        self.set_status(payment_id, request.match_info["status"])
+        return web.json_response(self.payments[payment_id])
+
+    def set_status(self, payment_id, status):
+        self.payments[payment_id]["status"] = status
+        self.payments[payment_id]["paid"] = status == "succeeded"
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return f"http://{host}:{port}/v3"
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--auto-succeed", action="store_true")
+    args = parser.parse_args()
+    fake = FakeYooKassa(args.latency, args.fail_rate, args.auto_succeed)
+    web.run_app(fake.app, host=args.host, port=args.port)
@@ -0,0 +1,898 @@
+import os
+import re
+import sqlite3
+import asyncio
+import sys
+import signal
+import logging
+import multiprocessing
+from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.strategy import FSMStrategy
+from aiogram.types import (
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    ReplyKeyboardMarkup,
+    KeyboardButton
+)
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from dotenv import load_dotenv
+
+from db import Database
+from repository import ShopRepository
+from catalog import CatalogCache
+from payments import YooKassaGateway
+from orders import OrderService
+from server import create_app, start_app
+from storage import create_storage
+from migrations import migrate
+from notifier import Notifier
+from metrics import PAYMENTS, STOCK_OUTS
+from metrics_middleware import metrics_handler, setup_metrics
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+logger = logging.getLogger(__name__)
+
+
+load_dotenv()
+
+
+TOKEN = os.getenv('BOT_TOKEN')
+YOOKASSA_SHOP_ID = os.getenv('YOOKASSA_SHOP_ID')
+YOOKASSA_SECRET_KEY = os.getenv('YOOKASSA_SECRET_KEY')
+YOOKASSA_API_URL = os.getenv('YOOKASSA_API_URL', 'https://api.yookassa.ru/v3')
+YOOKASSA_TIMEOUT = float(os.getenv('YOOKASSA_TIMEOUT', '10'))
+HTTP_HOST = os.getenv('HTTP_HOST', '0.0.0.0')
+HTTP_PORT = int(os.getenv('HTTP_PORT', '8080'))
+PAYMENT_CHECK_INTERVAL = int(os.getenv('PAYMENT_CHECK_INTERVAL', '5'))
+RESERVATION_TTL = int(os.getenv('RESERVATION_TTL', '900'))
+RECONCILE_INTERVAL = int(os.getenv('RECONCILE_INTERVAL', '30'))
+RECONCILE_BATCH_SIZE = int(os.getenv('RECONCILE_BATCH_SIZE', '50'))
+RECONCILE_MAX_INTERVAL = int(os.getenv('RECONCILE_MAX_INTERVAL', '3600'))
+DB_PATH = os.getenv('DB_PATH', 'shop.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+CATALOG_CACHE_TTL = int(os.getenv('CATALOG_CACHE_TTL', '300'))
+CATALOG_SYNC_INTERVAL = float(os.getenv('CATALOG_SYNC_INTERVAL', '1'))
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', '10'))
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
+REDIS_URL = os.getenv('REDIS_URL')
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', '86400'))
+RUN_MODE = os.getenv('RUN_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_IN_BACKGROUND = os.getenv('WEBHOOK_IN_BACKGROUND', '1') == '1'
+WEB_WORKERS = int(os.getenv('WEB_WORKERS', '1'))
+NOTIFY_RATE = float(os.getenv('NOTIFY_RATE', '25'))
+NOTIFY_CHAT_INTERVAL = float(os.getenv('NOTIFY_CHAT_INTERVAL', '1'))
+SLOW_UPDATE_SECONDS = float(os.getenv('SLOW_UPDATE_SECONDS', '0'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+
+if not TOKEN:
+    raise ValueError("❌ Токен бота не найден! Создайте файл .env с BOT_TOKEN=ваш_токен")
+if not YOOKASSA_SHOP_ID or not YOOKASSA_SECRET_KEY:
+    raise ValueError("❌ Параметры ЮKassa не найдены! Добавьте YOOKASSA_SHOP_ID и YOOKASSA_SECRET_KEY в .env")
+
+
+logger.info(f"ЮKassa: магазин {YOOKASSA_SHOP_ID}")
+
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=TOKEN, session=session)
+
+db = Database(DB_PATH, pool_size=DB_POOL_SIZE)
+storage = create_storage(db, REDIS_URL, FSM_STATE_TTL)
+dp = Dispatcher(storage=storage, fsm_strategy=FSMStrategy.CHAT)
+setup_metrics(dp, SLOW_UPDATE_SECONDS, PROFILE_SAMPLE_RATE)
+
+repo = ShopRepository(db)
+# Несколько процессов вебхука: изменения каталога из соседних процессов видны через catalog_version
+catalog = CatalogCache(
+    ttl=CATALOG_CACHE_TTL,
+    sync=repo.get_catalog_version if RUN_MODE == "webhook" and WEB_WORKERS > 1 else None,
+    sync_interval=CATALOG_SYNC_INTERVAL
+)
+yookassa = YooKassaGateway(YOOKASSA_SHOP_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL, timeout=YOOKASSA_TIMEOUT)
+
+ADMIN_IDS = []
+
+
+class PaymentStates(StatesGroup):
+    confirm_payment = State()
+    awaiting_payment_confirmation = State()
+
+class AdminStates(StatesGroup):
+    menu = State()
+    add_product_choose_category_type = State()
+    add_product_category = State()
+    add_product_name = State()
+    add_product_desc = State()
+    add_product_price = State()
+    add_product_stock = State()
+    add_product_promo = State()
+    restock_category = State()
+    restock_amount = State()
+    delete_select_category = State()
+    delete_select_product = State()
+    broadcast_text = State()
+
+
+def init_db():
+    conn = db.connect()
+    migrate(conn)
+    cursor = conn.cursor()
+
+    if not cursor.execute("SELECT 1 FROM products LIMIT 1").fetchone():
+        initial_data = [
+            ("🍔 Еда", "Макдоналдс", "Скидка 20%", 150, "MCD2023", 15),
+            ("🍔 Еда", "KFC", "Бесплатный напиток", 100, "KFCBEST", 10),
+            ("🎮 Игры", "Steam", "Ключ для любой игры", 500, "STEAM-1234", 5),
+            ("🎮 Игры", "Epic Games", "Рандомный ключ", 400, "EPIC-5678", 3),
+            ("📺 Подписки", "Spotify", "3 месяца Premium", 300, "SPOTY-2023", 8),
+            ("📺 Подписки", "Netflix", "1 месяц подписки", 350, "NETFLIX-2023", 6)
+        ]
+        cursor.execute("BEGIN")
+        cursor.executemany(
+            "INSERT INTO categories (name) VALUES (?)",
+            [(category,) for category in dict.fromkeys(row[0] for row in initial_data)]
+        )
+        cursor.executemany(
+            "INSERT INTO products (category_id, name, description, price, promo_code, stock) "
+            "VALUES ((SELECT id FROM categories WHERE name = ?), ?, ?, ?, ?, ?)",
+            initial_data
+        )
+        conn.commit()
+
+    conn.close()
+
+init_db()
+
+
+async def get_categories(include_empty=False):
+    return await catalog.get(("categories", include_empty), lambda: repo.get_categories(include_empty))
+
+async def get_category_name(category_id):
+    return dict(await get_categories(include_empty=True)).get(category_id)
+
+async def get_category_products(category_id):
+    return await catalog.get(("products", category_id), lambda: repo.get_category_products(category_id))
+
+async def get_product(product_id):
+    return await catalog.get(("product", product_id), lambda: repo.get_product(product_id))
+
+async def get_empty_categories():
+    return await repo.get_empty_categories()
+
+async def create_yookassa_payment(amount, description, product_id):
+    payment = await yookassa.create_payment(
+        amount,
+        description,
+        {"product_id": str(product_id)},
+        "https://t.me/kolmakovmagazin_bot"
+    )
+    return payment["id"], payment["confirmation"]["confirmation_url"]
+
+def admin_kb():
+    kb = [
+        [KeyboardButton(text="Добавить товар")],
+        [KeyboardButton(text="Пополнить категорию")],
+        [KeyboardButton(text="Просмотреть остатки")],
+        [KeyboardButton(text="Удалить товар")],
+        [KeyboardButton(text="Рассылка")],
+        [KeyboardButton(text="Выйти из админки")]
+    ]
+    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+
+async def main_kb():
+    return await catalog.get(("main_kb",), build_main_kb)
+
+async def build_main_kb():
+    categories = await get_categories(include_empty=True)
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=name, callback_data=f"cat_{category_id}")]
+        for category_id, name in categories
+    ])
+
+async def products_kb(category_id, after_id=0, before_id=None):
+    return await catalog.get(
+        ("products_kb", category_id, after_id, before_id),
+        lambda: build_products_kb(category_id, after_id, before_id)
+    )
+
+async def build_products_kb(category_id, after_id=0, before_id=None):
+    products, has_prev, has_next = await repo.get_category_page(category_id, after_id, before_id, PAGE_SIZE)
+    buttons = [
+        [InlineKeyboardButton(
+            text=f"{p[1]} - {p[2]}₽ ({p[3]} шт.)",
+            callback_data=f"prod_{p[0]}"
+        )] for p in products
+    ]
+    navigation = []
+    if has_prev and products:
+        navigation.append(InlineKeyboardButton(text="⬅️", callback_data=f"catp_{category_id}_b_{products[0][0]}"))
+    if has_next and products:
+        navigation.append(InlineKeyboardButton(text="➡️", callback_data=f"catp_{category_id}_a_{products[-1][0]}"))
+    if navigation:
+        buttons.append(navigation)
+    buttons.append([InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_main")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+async def history_page(user_id, older_than=None, newer_than=None):
+    purchases, has_newer, has_older = await repo.get_purchase_history(user_id, older_than, newer_than, PAGE_SIZE)
+    if not purchases:
+        return "📭 У вас пока нет покупок.", None
+    text = "📜 История ваших покупок:\n\n"
+    for purchase_id, name, category, price, date in purchases:
+        text += f"🛒 #{purchase_id}\n"
+        text += f"Товар: {name} ({category})\n"
+        text += f"Цена: {price}₽\n"
+        text += f"Дата: {date}\n\n"
+    navigation = []
+    if has_newer:
+        navigation.append(InlineKeyboardButton(text="⬅️ Новее", callback_data=f"hist_newer_{purchases[0][0]}"))
+    if has_older:
+        navigation.append(InlineKeyboardButton(text="Старше ➡️", callback_data=f"hist_older_{purchases[-1][0]}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[navigation]) if navigation else None
+
+def sold_out_kb(product_id):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔔 Сообщить о поступлении", callback_data=f"notify_{product_id}")],
+        [InlineKeyboardButton(text="↩️ Назад", callback_data="back_to_main")]
+    ])
+
+def payment_kb():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💳 Оплатить", callback_data="confirm_payment")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_payment")]
+    ])
+
+def support_kb():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🆘 Поддержка", url=f"tg://user?id={ADMIN_IDS[0]}")]
+    ])
+
+def check_payment_kb():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Проверить платеж", callback_data="check_payment")],
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="cancel_payment")]
+    ])
+
+def purchase_text(order):
+    return (
+        f"✅ Покупка #{order.purchase_id} совершена успешно!\n\n"
+        f"🎁 Товар: {order.name}\n"
+        f"🔑 Промокод: `{order.promo_code}`\n\n"
+        "Если возникли проблемы - воспользуйтесь командой /support"
+    )
+
+async def notify_fulfilled(order):
+    if order.status == "succeeded":
+        await bot.send_message(
+            order.user_id,
+            purchase_text(order),
+            parse_mode="Markdown",
+            reply_markup=support_kb()
+        )
+    else:
+        logger.error(f"Платёж {order.payment_id} оплачен, но товар {order.product_id} закончился")
+        await bot.send_message(
+            order.user_id,
+            "😔 Товар закончился после оплаты. Напишите в поддержку для возврата средств.",
+            reply_markup=support_kb()
+        )
+
+
+async def send_outbox_message(chat_id, text, product_id):
+    reply_markup = None
+    if product_id is not None:
+        reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🛒 Перейти к товару", callback_data=f"prod_{product_id}")]
+        ])
+    await bot.send_message(chat_id, text, reply_markup=reply_markup)
+
+def queue_eta(count):
+    minutes = count / NOTIFY_RATE / 60
+    return f"{minutes:.0f} мин." if minutes >= 1 else "меньше минуты"
+
+
+notifier = Notifier(repo, send_outbox_message, rate=NOTIFY_RATE, chat_interval=NOTIFY_CHAT_INTERVAL)
+
+orders = OrderService(
+    repo, yookassa, catalog, notify_fulfilled,
+    check_interval=PAYMENT_CHECK_INTERVAL,
+    reservation_ttl=RESERVATION_TTL,
+    reconcile_interval=RECONCILE_INTERVAL,
+    max_reconcile_interval=RECONCILE_MAX_INTERVAL
+)
+
+
+@dp.message(Command("start"))
+async def start(message: types.Message):
+    await repo.register_user(message.from_user.id)
+    await message.answer(
+        "🛍️ Добро пожаловать в магазин!\n"
+        "Выберите категорию товаров:",
+        reply_markup=await main_kb()
+    )
+
+@dp.message(Command("admin"))
+async def admin_panel(message: types.Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("Доступ запрещён")
+        return
+    await message.answer("Админ-панель:", reply_markup=admin_kb())
+    await state.set_state(AdminStates.menu)
+
+@dp.message(Command("history"))
+async def history(message: types.Message):
+    try:
+        text, reply_markup = await history_page(message.from_user.id)
+        await message.answer(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка получения истории: {e}")
+        await message.answer("⚠️ Не удалось загрузить историю покупок")
+
+@dp.callback_query(F.data.startswith("hist_"))
+async def history_navigate(callback: types.CallbackQuery):
+    await callback.answer()
+    try:
+        _, direction, purchase_id = callback.data.split("_", 2)
+        if direction == "older":
+            text, reply_markup = await history_page(callback.from_user.id, older_than=int(purchase_id))
+        else:
+            text, reply_markup = await history_page(callback.from_user.id, newer_than=int(purchase_id))
+        await callback.message.edit_text(text, reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка получения истории: {e}")
+        await callback.message.edit_text("⚠️ Не удалось загрузить историю покупок")
+
+@dp.message(Command("support"))
+async def support_command(message: types.Message):
+    await message.answer(
+        "🛟 Служба поддержки\n\n"
+        "Если у вас есть вопросы по покупке или работе бота, "
+        "нажмите кнопку ниже чтобы связаться с оператором",
+        reply_markup=support_kb()
+    )
+
+
+@dp.message(F.text == "Добавить товар", AdminStates.menu)
+async def add_product(message: types.Message, state: FSMContext):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="Новая категория", callback_data="new_category")
+    builder.button(text="Существующая категория", callback_data="existing_category")
+    await message.answer(
+        "Выберите тип категории для товара:",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(AdminStates.add_product_choose_category_type)
+
+@dp.callback_query(F.data == "new_category", AdminStates.add_product_choose_category_type)
+async def new_category(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    await callback.message.answer("Введите название новой категории:")
+    await state.set_state(AdminStates.add_product_category)
+
+@dp.callback_query(F.data == "existing_category", AdminStates.add_product_choose_category_type)
+async def existing_category(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    categories = await get_categories(include_empty=True)
+    builder = InlineKeyboardBuilder()
+    for category_id, name in categories:
+        builder.button(text=name, callback_data=f"existing_cat_{category_id}")
+    await callback.message.answer(
+        "Выберите существующую категорию:",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(AdminStates.add_product_category)
+
+@dp.callback_query(F.data.startswith("existing_cat_"), AdminStates.add_product_category)
+async def existing_category_select(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    category_id = int(callback.data.split("_", 2)[2])
+    await state.update_data(category=await get_category_name(category_id))
+    await callback.message.answer("Введите название товара:")
+    await state.set_state(AdminStates.add_product_name)
+
+@dp.message(AdminStates.add_product_category)
+async def add_product_category(message: types.Message, state: FSMContext):
+    await state.update_data(category=message.text)
+    await message.answer("Введите название товара:")
+    await state.set_state(AdminStates.add_product_name)
+
+@dp.message(AdminStates.add_product_name)
+async def add_product_name(message: types.Message, state: FSMContext):
+    await state.update_data(name=message.text)
+    await message.answer("Введите описание товара:")
+    await state.set_state(AdminStates.add_product_desc)
+
+@dp.message(AdminStates.add_product_desc)
+async def add_product_desc(message: types.Message, state: FSMContext):
+    await state.update_data(description=message.text)
+    await message.answer("Введите цену товара:")
+    await state.set_state(AdminStates.add_product_price)
+
+@dp.message(AdminStates.add_product_price)
+async def add_product_price(message: types.Message, state: FSMContext):
+    if not message.text.isdigit():
+        await message.answer("Введите корректную цену товара (число):")
+        return
+    await state.update_data(price=int(message.text))
+    await message.answer("Введите количество товара:")
+    await state.set_state(AdminStates.add_product_stock)
+
+@dp.message(AdminStates.add_product_stock)
+async def add_product_stock(message: types.Message, state: FSMContext):
+    if not message.text.isdigit():
+        await message.answer("Введите корректное количество товара (число):")
+        return
+    await state.update_data(stock=int(message.text))
+    await message.answer(
+        "Введите промокод товара (если есть, или 'нет').\n"
+        "Чтобы у каждой единицы был свой код, перечислите коды через запятую или с новой строки:"
+    )
+    await state.set_state(AdminStates.add_product_promo)
+
+@dp.message(AdminStates.add_product_promo)
+async def add_product_promo(message: types.Message, state: FSMContext):
+    promo_code = message.text.strip() if message.text.strip().lower() != 'нет' else None
+    # Коды разделяются только запятыми и переводами строк: пробел может быть частью кода
+    codes = [code.strip() for code in re.split(r"[,\n]", promo_code)] if promo_code else []
+    codes = [code for code in codes if code]
+    data = await state.get_data()
+    stock = data['stock']
+    if len(codes) > 1:
+        # Пул уникальных кодов: на складе столько единиц, сколько кодов
+        promo_code, stock = None, len(codes)
+    else:
+        promo_code, codes = (codes[0] if codes else None), []
+    try:
+        _, category_id = await repo.add_product(
+            data['category'], data['name'], data['description'], data['price'], promo_code, stock, codes
+        )
+        catalog.category_changed(category_id)
+        await message.answer(
+            f"✅ Товар успешно добавлен!\n\n"
+            f"Категория: {data['category']}\n"
+            f"Название: {data['name']}\n"
+            f"Цена: {data['price']}₽\n"
+            f"Количество: {stock} шт.\n"
+            f"Промокод: {promo_code if promo_code else f'{len(codes)} уникальных' if codes else 'отсутствует'}",
+            reply_markup=admin_kb()
+        )
+    except sqlite3.IntegrityError as e:
+        if "UNIQUE constraint failed" in str(e):
+            await message.answer(
+                "❌ Ошибка: промокод уже существует. Введите другой промокод:"
+            )
+            return
+        await message.answer(f"❌ Ошибка базы данных: {str(e)}")
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+    finally:
+        await state.set_state(AdminStates.menu)
+
+@dp.message(F.text == "Пополнить категорию", AdminStates.menu)
+async def restock_start(message: types.Message, state: FSMContext):
+    empty_categories = await get_empty_categories()
+    if not empty_categories:
+        await message.answer("Нет категорий с нулевыми остатками")
+        return
+    builder = InlineKeyboardBuilder()
+    for category_id, name in empty_categories:
+        builder.button(text=name, callback_data=f"restock_cat_{category_id}")
+    await message.answer(
+        "Выберите категорию для пополнения:",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(AdminStates.restock_category)
+
+@dp.callback_query(F.data.startswith("restock_cat_"), AdminStates.restock_category)
+async def restock_category_select(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    category_id = int(callback.data.split("_", 2)[2])
+    await state.update_data(restock_category=category_id)
+    await callback.message.answer("Введите количество для добавления:")
+    await state.set_state(AdminStates.restock_amount)
+
+@dp.message(AdminStates.restock_amount)
+async def restock_process(message: types.Message, state: FSMContext):
+    if not message.text.isdigit():
+        await message.answer("Введите корректное количество (только число):")
+        return
+    amount = int(message.text)
+    data = await state.get_data()
+    category_id = data['restock_category']
+    try:
+        _, skipped = await repo.restock_category(category_id, amount)
+        catalog.category_changed(category_id)
+        queued = await repo.queue_restock_notifications(category_id, "🔔 Снова в наличии: {name}")
+        notifier.wake()
+        await message.answer(
+            f"✅ Категория {await get_category_name(category_id)} успешно пополнена на {amount} единиц!"
+            + (f"\n⚠️ Товаров с уникальными кодами пропущено: {skipped} — "
+               f"их остаток равен числу кодов, добавьте товар заново с новыми кодами" if skipped else "")
+            + (f"\n🔔 Уведомлений подписчикам: {queued}" if queued else ""),
+            reply_markup=admin_kb()
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+    finally:
+        await state.set_state(AdminStates.menu)
+
+@dp.message(F.text == "Просмотреть остатки", AdminStates.menu)
+async def view_stock(message: types.Message):
+    products = await repo.get_stock_report()
+    if not products:
+        await message.answer("Нет товаров в базе")
+        return
+    text = "📦 Остатки товаров:\n\n"
+    current_category = None
+    for category, name, stock in products:
+        if category != current_category:
+            text += f"\n<b>{category}</b>\n"
+            current_category = category
+        text += f"{name}: {stock} шт.\n"
+    await message.answer(text, parse_mode="HTML")
+
+@dp.message(F.text == "Удалить товар", AdminStates.menu)
+async def delete_start(message: types.Message, state: FSMContext):
+    categories = await get_categories(include_empty=True)
+    if not categories:
+        await message.answer("Нет доступных категорий.")
+        return
+    builder = InlineKeyboardBuilder()
+    for category_id, name in categories:
+        builder.button(text=name, callback_data=f"delcat_{category_id}")
+    await message.answer(
+        "Выберите категорию для удаления товара:",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(AdminStates.delete_select_category)
+
+@dp.callback_query(F.data.startswith("delcat_"), AdminStates.delete_select_category)
+async def delete_choose_product(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    category_id = int(callback.data.split("_", 1)[1])
+    await state.update_data(del_category=category_id)
+    products = await get_category_products(category_id)
+    if not products:
+        await callback.message.answer("В этой категории нет товаров.")
+        return
+    builder = InlineKeyboardBuilder()
+    for pid, name, _, _ in products:
+        builder.button(text=name, callback_data=f"delprod_{pid}")
+    await callback.message.answer(
+        "Выберите товар для удаления:",
+        reply_markup=builder.as_markup()
+    )
+    await state.set_state(AdminStates.delete_select_product)
+
+@dp.callback_query(F.data.startswith("delprod_"), AdminStates.delete_select_product)
+async def delete_product(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    product_id = int(callback.data.split("_", 1)[1])
+    try:
+        await repo.delete_product(product_id)
+        data = await state.get_data()
+        catalog.category_changed(data.get('del_category'))
+        await callback.message.answer(
+            "✅ Товар успешно удалён.",
+            reply_markup=admin_kb()
+        )
+    except Exception as e:
+        await callback.message.answer(
+            f"❌ Ошибка при удалении товара: {str(e)}",
+            reply_markup=admin_kb()
+        )
+    finally:
+        await state.set_state(AdminStates.menu)
+
+@dp.message(F.text == "Рассылка", AdminStates.menu)
+async def broadcast_start(message: types.Message, state: FSMContext):
+    await message.answer("Введите текст рассылки (или 'отмена'):")
+    await state.set_state(AdminStates.broadcast_text)
+
+@dp.message(AdminStates.broadcast_text)
+async def broadcast_send(message: types.Message, state: FSMContext):
+    try:
+        if not message.text or message.text.strip().lower() == 'отмена':
+            await message.answer("Рассылка отменена", reply_markup=admin_kb())
+            return
+        queued = await repo.queue_broadcast(message.text)
+        notifier.wake()
+        pending = await repo.count_outbox_pending()
+        await message.answer(
+            f"📣 Рассылка поставлена в очередь: {queued} получателей.\n"
+            f"Всего в очереди {pending} сообщений, отправка займёт {queue_eta(pending)}",
+            reply_markup=admin_kb()
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка: {str(e)}")
+    finally:
+        await state.set_state(AdminStates.menu)
+
+@dp.message(F.text == "Выйти из админки", AdminStates.menu)
+async def exit_admin(message: types.Message, state: FSMContext):
+    await message.answer(
+        "Админ-панель закрыта",
+        reply_markup=types.ReplyKeyboardRemove()
+    )
+    await state.clear()
+    await start(message)
+
+
+@dp.callback_query(F.data.startswith("cat_"))
+async def show_products(callback: types.CallbackQuery):
+    await callback.answer()
+    try:
+        category_id = int(callback.data.split("_", 1)[1])
+        await callback.message.edit_text(
+            f"🔍 Категория: {await get_category_name(category_id)}\nВыберите товар:",
+            reply_markup=await products_kb(category_id)
+        )
+    except Exception as e:
+        logger.error(f"Ошибка показа товаров: {e}")
+        await callback.message.edit_text("⚠️ Ошибка загрузки товаров")
+
+@dp.callback_query(F.data.startswith("catp_"))
+async def show_products_page(callback: types.CallbackQuery):
+    await callback.answer()
+    try:
+        _, category_id, direction, product_id = callback.data.split("_")
+        category_id, product_id = int(category_id), int(product_id)
+        if direction == "a":
+            reply_markup = await products_kb(category_id, after_id=product_id)
+        else:
+            reply_markup = await products_kb(category_id, before_id=product_id)
+        await callback.message.edit_reply_markup(reply_markup=reply_markup)
+    except Exception as e:
+        logger.error(f"Ошибка показа товаров: {e}")
+        await callback.message.edit_text("⚠️ Ошибка загрузки товаров")
+
+@dp.callback_query(F.data.startswith("prod_"))
+async def show_product(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    try:
+        product_id = int(callback.data.split("_", 1)[1])
+        product = await get_product(product_id)
+        if not product:
+            await callback.message.edit_text("😔 Товар закончился")
+            return
+        if product[3] <= 0:
+            STOCK_OUTS.inc("view")
+            await callback.message.edit_text(
+                f"😔 Товар {product[0]} закончился",
+                reply_markup=sold_out_kb(product_id)
+            )
+            return
+        name, desc, price, stock = product
+        await callback.message.edit_text(
+            f"🎁 *{name}*\n\n"
+            f"📝 {desc}\n"
+            f"💵 Цена: {price}₽\n"
+            f"📦 Осталось: {stock} шт.\n\n"
+            "Нажмите 'Оплатить' для покупки",
+            reply_markup=payment_kb(),
+            parse_mode="Markdown"
+        )
+        await state.set_state(PaymentStates.confirm_payment)
+        await state.update_data(product_id=product_id)
+    except Exception as e:
+        logger.error(f"Ошибка показа товара: {e}")
+        await callback.message.edit_text("⚠️ Ошибка загрузки товара")
+
+@dp.callback_query(F.data.startswith("notify_"))
+async def subscribe_restock(callback: types.CallbackQuery):
+    try:
+        product_id = int(callback.data.split("_", 1)[1])
+        await repo.subscribe_restock(callback.from_user.id, product_id)
+        await callback.answer("🔔 Сообщим, когда товар появится")
+    except Exception as e:
+        logger.error(f"Ошибка подписки на поступление: {e}")
+        await callback.answer("⚠️ Не удалось подписаться", show_alert=True)
+
+@dp.callback_query(F.data == "confirm_payment", PaymentStates.confirm_payment)
+async def process_payment(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    try:
+        data = await state.get_data()
+        product_id = data['product_id']
+        user_id = callback.from_user.id
+        product = await repo.get_product(product_id)
+        if not product or product[3] <= 0:
+            STOCK_OUTS.inc("reserve")
+            await callback.message.edit_text("😔 Товар закончился")
+            return
+        name, desc, price, stock = product
+        if data.get('payment_id'):
+            # Покупку начали заново, не оплатив прошлую: её единица возвращается на склад
+            await orders.release(payment_id=data['payment_id'])
+            await state.update_data(payment_id=None)
+        reservation_id = await orders.reserve(user_id, product_id)
+        if reservation_id is None:
+            await callback.message.edit_text("😔 Товар закончился", reply_markup=sold_out_kb(product_id))
+            return
+        try:
+            payment_id, payment_url = await create_yookassa_payment(price, f"Покупка: {name}", product_id)
+            await repo.create_payment_record(payment_id, user_id, product_id, price, reservation_id)
+            PAYMENTS.inc("created")
+        except Exception:
+            await orders.release(reservation_id=reservation_id)
+            raise
+        await state.update_data(payment_id=payment_id, user_id=user_id)
+        await callback.message.edit_text(
+            f"💳 Для оплаты товара *{name}* перейдите по ссылке:\n\n"
+            f"[Оплатить {price}₽]({payment_url})\n\n"
+            f"Товар закреплён за вами на {RESERVATION_TTL // 60} мин.\n"
+            "После оплаты нажмите 'Проверить платеж' ниже.",
+            reply_markup=check_payment_kb(),
+            parse_mode="Markdown"
+        )
+        await state.set_state(PaymentStates.awaiting_payment_confirmation)
+    except Exception as e:
+        logger.error(f"Ошибка создания платежа: {e}")
+        await callback.message.edit_text("⚠️ Ошибка при создании платежа")
+
+@dp.callback_query(F.data == "check_payment", PaymentStates.awaiting_payment_confirmation)
+async def check_payment(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    try:
+        data = await state.get_data()
+        payment_id = data['payment_id']
+        order = await orders.refresh(payment_id)
+        if order is None:
+            raise LookupError(f"платёж {payment_id} не найден")
+        if order.status == "succeeded":
+            await callback.message.edit_text(
+                purchase_text(order),
+                parse_mode="Markdown",
+                reply_markup=support_kb()
+            )
+            await state.clear()
+        elif order.status == "sold_out":
+            await callback.message.edit_text("😔 Товар закончился")
+            await state.clear()
+        elif order.status == "canceled":
+            await callback.message.edit_text(
+                "❌ Платеж был отменен или не удался. Попробуйте снова.",
+                reply_markup=await main_kb()
+            )
+            await state.clear()
+        else:
+            await callback.message.edit_text(
+                "⏳ Платеж еще не завершен. Нажмите 'Проверить' снова через несколько секунд.",
+                reply_markup=check_payment_kb()
+            )
+    except Exception as e:
+        logger.error(f"Ошибка проверки платежа: {e}")
+        await callback.message.edit_text("⚠️ Ошибка при проверке платежа")
+
+@dp.callback_query(F.data == "cancel_payment")
+async def cancel_payment(callback: types.CallbackQuery, state: FSMContext):
+    await callback.answer()
+    try:
+        data = await state.get_data()
+        if data.get('payment_id'):
+            await orders.release(payment_id=data['payment_id'])
+        await callback.message.edit_text(
+            "❌ Покупка отменена",
+            reply_markup=await main_kb()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка отмены платежа: {e}")
+        await callback.message.edit_text("⚠️ Ошибка при отмене")
+    finally:
+        await state.clear()
+
+@dp.callback_query(F.data == "back_to_main")
+async def back_to_main(callback: types.CallbackQuery):
+    await callback.answer()
+    try:
+        await callback.message.edit_text(
+            "Выберите категорию:",
+            reply_markup=await main_kb()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка возврата: {e}")
+        await callback.message.edit_text("⚠️ Ошибка при возврате")
+
+
+async def run_polling():
+    runner = await start_app(create_app(orders), HTTP_HOST, HTTP_PORT)
+    tasks = start_background_tasks()
+    try:
+        await dp.start_polling(bot, skip_updates=True)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await runner.cleanup()
+        await yookassa.close()
+        db.close()
+
+def start_background_tasks():
+    tasks = [
+        asyncio.create_task(orders.run_reconciler(RECONCILE_BATCH_SIZE)),
+        asyncio.create_task(orders.run_reservation_sweeper()),
+        asyncio.create_task(notifier.run())
+    ]
+    if hasattr(storage, "run_evictor"):
+        tasks.append(asyncio.create_task(storage.run_evictor()))
+    return tasks
+
+def run_webhook_worker(worker_index):
+    """Один процесс вебхука. Все процессы слушают общий порт (SO_REUSEPORT)
+    и делят состояние FSM через общее хранилище."""
+    app = create_app(orders)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=WEBHOOK_IN_BACKGROUND,
+        secret_token=WEBHOOK_SECRET
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    async def on_startup(app):
+        # Сверка, очистка и отправка очереди нужны в одном экземпляре
+        app["tasks"] = start_background_tasks() if worker_index == 0 else []
+        app["metrics_runner"] = None
+        if METRICS_PORT:
+            # Основной порт общий, а метрики у каждого процесса свои
+            metrics_app = web.Application()
+            metrics_app.router.add_get("/metrics", metrics_handler)
+            app["metrics_runner"] = await start_app(metrics_app, HTTP_HOST, METRICS_PORT + worker_index)
+
+    async def on_cleanup(app):
+        for task in app["tasks"]:
+            task.cancel()
+        if app["metrics_runner"] is not None:
+            await app["metrics_runner"].cleanup()
+        await yookassa.close()
+        db.close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    web.run_app(app, host=HTTP_HOST, port=HTTP_PORT, reuse_port=WEB_WORKERS > 1, print=None)
+
+def run_webhook():
+    async def set_webhook():
+        await bot.set_webhook(f"{WEBHOOK_URL}{WEBHOOK_PATH}", secret_token=WEBHOOK_SECRET, drop_pending_updates=True)
+        await bot.session.close()
+
+    if WEBHOOK_URL:
+        asyncio.run(set_webhook())
+    if WEB_WORKERS == 1:
+        run_webhook_worker(0)
+        return
+    workers = [
+        multiprocessing.Process(target=run_webhook_worker, args=(index,), daemon=True)
+        for index in range(WEB_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Запущено процессов вебхука: {WEB_WORKERS}")
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+
+if __name__ == "__main__":
+    if RUN_MODE == "webhook":
+        run_webhook()
+    else:
+        asyncio.run(run_polling())
@@ -0,0 +1,175 @@
+"""Метрики в формате Prometheus без внешних зависимостей.
+
+Здесь только реестр и инструменты, чтобы слой данных и клиент ЮKassa
+не тянули aiogram и aiohttp; middleware и HTTP-обработчик — в
+metrics_middleware.py.
+"""
+import bisect
+import contextvars
+import threading
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metric:
+    """Метрика с метками. Значения хранятся по кортежу значений меток."""
+
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _label_text(self, values, extra=""):
+        pairs = [f'{label}="{_escape(value)}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self):
+        for values, value in sorted(self._values.items()):
+            yield f"{self.name}{self._label_text(values)} {value}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(Metric):
+    """Гистограмма с фиксированными корзинами. observe() — bisect и три сложения."""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        for values, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{self._label_text(values, le)} {cumulative}"
+            yield f"{self.name}_sum{self._label_text(values)} {total}"
+            yield f"{self.name}_count{self._label_text(values)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+UPDATES_IN_FLIGHT = REGISTRY.gauge("shop_updates_in_flight", "Апдейты в обработке")
+UPDATES = REGISTRY.counter("shop_updates_total", "Полученные апдейты", ["type"])
+UPDATE_SECONDS = REGISTRY.histogram("shop_update_seconds", "Полное время обработки апдейта", ["type"])
+HANDLER_SECONDS = REGISTRY.histogram("shop_handler_seconds", "Время работы хендлера", ["handler"])
+HANDLER_ERRORS = REGISTRY.counter("shop_handler_errors_total", "Исключения, вышедшие из хендлера", ["handler"])
+SLOW_UPDATES = REGISTRY.counter("shop_slow_updates_total", "Апдейты дольше порога", ["handler"])
+FSM_TRANSITIONS = REGISTRY.counter("shop_fsm_transitions_total", "Переходы состояний FSM", ["from_state", "to_state"])
+DB_QUERY_SECONDS = REGISTRY.histogram("shop_db_query_seconds", "Время выполнения запроса SQLite", ["query"])
+DB_WAIT_SECONDS = REGISTRY.histogram("shop_db_pool_wait_seconds", "Ожидание свободного соединения в пуле")
+DB_ERRORS = REGISTRY.counter("shop_db_errors_total", "Ошибки запросов SQLite", ["query"])
+YOOKASSA_SECONDS = REGISTRY.histogram("shop_yookassa_request_seconds", "Время запроса к API ЮKassa", ["operation"])
+YOOKASSA_REQUESTS = REGISTRY.counter(
+    "shop_yookassa_requests_total", "Запросы к API ЮKassa по результату: ok, код HTTP, timeout, network",
+    ["operation", "outcome"]
+)
+PAYMENTS = REGISTRY.counter("shop_payments_total", "Платежи: created, succeeded, sold_out, canceled", ["status"])
+STOCK_OUTS = REGISTRY.counter("shop_stock_outs_total", "Покупатель упёрся в нулевой остаток", ["stage"])
+
+
+class UpdateTrace:
+    """Из чего сложилось время одного апдейта: для журнала медленных апдейтов."""
+
+    __slots__ = ("handler", "db_seconds", "db_queries", "slowest_query", "yookassa_seconds", "yookassa_requests")
+
+    def __init__(self):
+        self.handler = None
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.slowest_query = (0.0, None)
+        self.yookassa_seconds = 0.0
+        self.yookassa_requests = 0
+
+
+update_trace = contextvars.ContextVar("update_trace", default=None)
+
+
+def observe_query(label, wait, elapsed):
+    DB_WAIT_SECONDS.observe(wait)
+    DB_QUERY_SECONDS.observe(elapsed, label)
+    trace = update_trace.get()
+    if trace is not None:
+        trace.db_seconds += wait + elapsed
+        trace.db_queries += 1
+        if elapsed > trace.slowest_query[0]:
+            trace.slowest_query = (elapsed, label)
+
+
+def observe_yookassa(operation, elapsed, outcome):
+    YOOKASSA_SECONDS.observe(elapsed, operation)
+    YOOKASSA_REQUESTS.inc(operation, outcome)
+    trace = update_trace.get()
+    if trace is not None:
+        trace.yookassa_seconds += elapsed
+        trace.yookassa_requests += 1
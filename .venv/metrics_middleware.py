@@ -0,0 +1,131 @@
+import cProfile
+import io
+import logging
+import pstats
+import random
+import time
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiohttp import web
+
+from metrics import (
+    FSM_TRANSITIONS, HANDLER_ERRORS, HANDLER_SECONDS, REGISTRY, SLOW_UPDATES, UPDATE_SECONDS,
+    UPDATES, UPDATES_IN_FLIGHT, UpdateTrace, update_trace
+)
+
+
+logger = logging.getLogger(__name__)
+
+_profiling = False
+
+
+def _state_name(state):
+    return (state.state if isinstance(state, State) else state) or "none"
+
+
+class _TrackedContext(FSMContext):
+    """FSMContext, который считает переходы; прежнее состояние берётся
+    из raw_state, поэтому лишнего чтения хранилища нет."""
+
+    def __init__(self, context, current):
+        super().__init__(context.storage, context.key)
+        self.current = _state_name(current)
+
+    async def set_state(self, state=None):
+        await super().set_state(state)
+        new = _state_name(state)
+        if new != self.current:
+            FSM_TRANSITIONS.inc(self.current, new)
+            self.current = new
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: апдейты в обработке, полное время
+    и журнал медленных апдейтов.
+
+    slow_threshold — порог в секундах, 0 отключает журнал. С вероятностью
+    profile_rate апдейт выполняется под cProfile (не больше одного сразу),
+    и если он оказался медленным, профиль попадает в журнал. Профиль
+    захватывает и задачи, которые event loop выполнял параллельно.
+    """
+
+    def __init__(self, slow_threshold=0.0, profile_rate=0.0):
+        self.slow_threshold = slow_threshold
+        self.profile_rate = profile_rate
+
+    async def __call__(self, handler, event, data):
+        global _profiling
+        update_type = event.event_type
+        trace = UpdateTrace()
+        token = update_trace.set(trace)
+        profiler = None
+        if self.profile_rate and not _profiling and random.random() < self.profile_rate:
+            _profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+        UPDATES.inc(update_type)
+        UPDATES_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            UPDATES_IN_FLIGHT.dec()
+            UPDATE_SECONDS.observe(elapsed, update_type)
+            if profiler is not None:
+                profiler.disable()
+                _profiling = False
+            update_trace.reset(token)
+            if self.slow_threshold and elapsed >= self.slow_threshold:
+                self._log_slow(event, trace, elapsed, profiler)
+
+    def _log_slow(self, event, trace, elapsed, profiler):
+        SLOW_UPDATES.inc(trace.handler or "unhandled")
+        slowest_seconds, slowest_query = trace.slowest_query
+        message = (
+            f"Медленный апдейт {event.update_id} ({event.event_type}, {trace.handler or 'без хендлера'}): "
+            f"{elapsed * 1000:.0f} мс; SQLite {trace.db_queries} запр. {trace.db_seconds * 1000:.0f} мс"
+            f" (самый долгий {slowest_query} {slowest_seconds * 1000:.0f} мс); "
+            f"ЮKassa {trace.yookassa_requests} запр. {trace.yookassa_seconds * 1000:.0f} мс"
+        )
+        if profiler is not None:
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats("tottime").print_stats(20)
+            message += "\n" + output.getvalue()
+        logger.warning(message)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware на наблюдателях: время и ошибки по хендлерам, переходы FSM."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        trace = update_trace.get()
+        if trace is not None:
+            trace.handler = name
+        if "state" in data:
+            data["state"] = _TrackedContext(data["state"], data.get("raw_state"))
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+
+
+def setup_metrics(dp, slow_threshold=0.0, profile_rate=0.0):
+    dp.update.outer_middleware(UpdateMetricsMiddleware(slow_threshold, profile_rate))
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
+
+
+async def metrics_handler(request):
+    return web.Response(
+        body=REGISTRY.render().encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
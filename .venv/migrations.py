@@ -0,0 +1,214 @@
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def initial_schema(cursor):
+    # Таблицы, которые раньше создавал init_db(): на существующей базе ничего не меняет
+    cursor.execute('''CREATE TABLE IF NOT EXISTS products
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     category TEXT NOT NULL,
+                     name TEXT NOT NULL,
+                     description TEXT,
+                     price INTEGER NOT NULL,
+                     promo_code TEXT UNIQUE,
+                     stock INTEGER DEFAULT 1,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS purchases
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     user_id INTEGER NOT NULL,
+                     product_id INTEGER NOT NULL,
+                     purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (product_id) REFERENCES products (id))''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS payments
+                     (payment_id TEXT PRIMARY KEY,
+                     user_id INTEGER NOT NULL,
+                     product_id INTEGER NOT NULL,
+                     amount INTEGER NOT NULL,
+                     status TEXT NOT NULL DEFAULT 'pending',
+                     purchase_id INTEGER,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     checked_at TIMESTAMP,
+                     FOREIGN KEY (product_id) REFERENCES products (id),
+                     FOREIGN KEY (purchase_id) REFERENCES purchases (id))''')
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments (status, checked_at)")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS promo_codes
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     product_id INTEGER NOT NULL,
+                     code TEXT NOT NULL UNIQUE,
+                     status TEXT NOT NULL DEFAULT 'available',
+                     FOREIGN KEY (product_id) REFERENCES products (id))''')
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_promo_codes_product ON promo_codes (product_id, status)")
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS reservations
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     product_id INTEGER NOT NULL,
+                     user_id INTEGER NOT NULL,
+                     payment_id TEXT UNIQUE,
+                     code_id INTEGER,
+                     status TEXT NOT NULL DEFAULT 'held',
+                     expires_at REAL NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (product_id) REFERENCES products (id),
+                     FOREIGN KEY (code_id) REFERENCES promo_codes (id))''')
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservations_held ON reservations (status, expires_at)")
+
+
+def normalize_categories(cursor):
+    cursor.execute('''CREATE TABLE categories
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     name TEXT NOT NULL UNIQUE,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute(
+        "INSERT INTO categories (name) "
+        "SELECT category FROM products GROUP BY category ORDER BY MIN(id)"
+    )
+    sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'products'").fetchone()
+
+    cursor.execute('''CREATE TABLE products_new
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     category_id INTEGER NOT NULL,
+                     name TEXT NOT NULL,
+                     description TEXT,
+                     price INTEGER NOT NULL,
+                     promo_code TEXT UNIQUE,
+                     stock INTEGER DEFAULT 1,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     FOREIGN KEY (category_id) REFERENCES categories (id))''')
+    cursor.execute('''
+        INSERT INTO products_new (id, category_id, name, description, price, promo_code, stock, created_at)
+        SELECT p.id, c.id, p.name, p.description, p.price, p.promo_code, p.stock, p.created_at
+        FROM products p
+        JOIN categories c ON c.name = p.category
+    ''')
+    cursor.execute("DROP TABLE products")
+    cursor.execute("ALTER TABLE products_new RENAME TO products")
+    if sequence:
+        # Не выдавать заново id удалённых товаров
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'products'", (sequence[0],))
+
+
+def listing_indexes(cursor):
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_category_stock ON products (category_id, stock)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_user_date ON purchases (user_id, purchase_date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_purchases_product ON purchases (product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_reservations_product ON reservations (product_id)")
+
+
+def outbound_queue(cursor):
+    cursor.execute('''CREATE TABLE users
+                     (user_id INTEGER PRIMARY KEY,
+                     blocked INTEGER NOT NULL DEFAULT 0,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute(
+        "INSERT OR IGNORE INTO users (user_id) "
+        "SELECT user_id FROM purchases UNION SELECT user_id FROM payments"
+    )
+
+    cursor.execute('''CREATE TABLE stock_subscriptions
+                     (product_id INTEGER NOT NULL,
+                     user_id INTEGER NOT NULL,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                     PRIMARY KEY (product_id, user_id),
+                     FOREIGN KEY (product_id) REFERENCES products (id))''')
+
+    # Исходящие сообщения. not_before — unix time, раньше которого не отправлять
+    cursor.execute('''CREATE TABLE outbox
+                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                     chat_id INTEGER NOT NULL,
+                     text TEXT NOT NULL,
+                     product_id INTEGER,
+                     status TEXT NOT NULL DEFAULT 'pending',
+                     attempts INTEGER NOT NULL DEFAULT 0,
+                     not_before REAL NOT NULL DEFAULT 0,
+                     error TEXT,
+                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    cursor.execute("CREATE INDEX idx_outbox_pending ON outbox (status, not_before)")
+
+
+def payment_cancel_flag(cursor):
+    # Платежи, от которых пользователь отказался кнопкой «Отмена», сверяются реже
+    cursor.execute("ALTER TABLE payments ADD COLUMN canceled_by_user INTEGER NOT NULL DEFAULT 0")
+
+
+def fsm_storage(cursor):
+    # Раньше таблицу создавал SQLiteStorage при запуске: на таких базах она уже есть
+    cursor.execute('''CREATE TABLE IF NOT EXISTS fsm_states
+                     (key TEXT PRIMARY KEY,
+                     state TEXT,
+                     data TEXT NOT NULL DEFAULT '{}',
+                     updated_at REAL NOT NULL)''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)")
+
+
+def catalog_version(cursor):
+    # Счётчик изменений каталога: по нему процессы вебхука сбрасывают свои кэши
+    cursor.execute('''CREATE TABLE catalog_version
+                     (id INTEGER PRIMARY KEY CHECK (id = 1),
+                     version INTEGER NOT NULL)''')
+    cursor.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0)")
+
+
+def one_hold_per_buyer(cursor):
+    # Лишние резервы одного покупателя на один товар возвращаются на склад, остаётся последний
+    duplicates = cursor.execute('''
+        SELECT id, product_id, code_id FROM reservations r
+        WHERE status = 'held' AND id < (
+            SELECT MAX(id) FROM reservations
+            WHERE user_id = r.user_id AND product_id = r.product_id AND status = 'held'
+        )
+    ''').fetchall()
+    for reservation_id, product_id, code_id in duplicates:
+        cursor.execute("UPDATE reservations SET status = 'released' WHERE id = ?", (reservation_id,))
+        cursor.execute("UPDATE products SET stock = stock + 1 WHERE id = ?", (product_id,))
+        if code_id is not None:
+            cursor.execute("UPDATE promo_codes SET status = 'available' WHERE id = ?", (code_id,))
+    cursor.execute(
+        "CREATE UNIQUE INDEX idx_reservations_one_held ON reservations (user_id, product_id) "
+        "WHERE status = 'held'"
+    )
+
+
+MIGRATIONS = [
+    initial_schema,
+    normalize_categories,
+    listing_indexes,
+    outbound_queue,
+    payment_cancel_flag,
+    fsm_storage,
+    catalog_version,
+    one_hold_per_buyer,
+]
+
+
+def migrate(conn, target=None):
+    """Применить недостающие миграции. Номер версии хранится в PRAGMA user_version.
+
+    Каждая миграция выполняется в своей транзакции BEGIN IMMEDIATE, поэтому
+    несколько процессов, стартующих одновременно, не применят её дважды.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    cursor = conn.cursor()
+    while True:
+        cursor.execute("BEGIN IMMEDIATE")
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= target:
+            cursor.execute("COMMIT")
+            return version
+        try:
+            MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+        logger.info(f"Применена миграция {version + 1}: {MIGRATIONS[version].__name__}")
@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Маркерное ведро: rate маркеров в секунду, не больше capacity подряд.
+
+    pause() останавливает выдачу целиком — так выполняется retry_after от Telegram.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Notifier:
+    """Отправка сообщений из очереди outbox в пределах лимитов Telegram.
+
+    Все сообщения бота делят ведро на rate сообщений в секунду, в один чат —
+    не чаще раза в chat_interval секунд. Очередь хранится в базе, поэтому
+    после перезапуска отправка продолжается с того же места. Сообщение
+    удаляется из очереди после ответа Telegram (доставка «хотя бы один раз»).
+    send(chat_id, text, product_id) отправляет одно сообщение.
+    """
+
+    def __init__(self, repo, send, rate=25, chat_interval=1.0, batch_size=100,
+                 concurrency=20, max_attempts=5, poll_interval=2):
+        self.repo = repo
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.chat_interval = chat_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chat_ready = {}
+        self._wakeup = asyncio.Event()
+
+    def wake(self):
+        """Новые сообщения в очереди: не ждать poll_interval."""
+        self._wakeup.set()
+
+    async def _deliver(self, message):
+        message_id, chat_id, text, product_id, attempts = message
+        try:
+            await self.send(chat_id, text, product_id)
+            self.sent += 1
+            await self.repo.outbox_sent(message_id)
+        except TelegramRetryAfter as e:
+            self.throttled += 1
+            logger.warning(f"Telegram просит подождать {e.retry_after} с")
+            self.bucket.pause(e.retry_after)
+            await self.repo.outbox_postpone(message_id, time.time() + e.retry_after, str(e), attempt=False)
+        except TelegramForbiddenError as e:
+            self.failed += 1
+            await self.repo.outbox_failed(message_id, str(e), blocked_chat_id=chat_id)
+        except TelegramBadRequest as e:
+            self.failed += 1
+            await self.repo.outbox_failed(message_id, str(e))
+        except Exception as e:
+            logger.error(f"Ошибка отправки сообщения {message_id} в чат {chat_id}: {e}")
+            if attempts + 1 >= self.max_attempts:
+                self.failed += 1
+                await self.repo.outbox_failed(message_id, str(e))
+            else:
+                await self.repo.outbox_postpone(message_id, time.time() + min(5 * 2 ** attempts, 600), str(e))
+        finally:
+            self._slots.release()
+
+    async def drain(self):
+        """Отправить одну пачку готовых сообщений. Возвращает размер пачки."""
+        batch = await self.repo.get_outbox_batch(self.batch_size)
+        if not batch:
+            return 0
+        now = time.monotonic()
+        self._chat_ready = {chat_id: ready for chat_id, ready in self._chat_ready.items() if ready > now}
+        tasks = []
+        for message in batch:
+            chat_id = message[1]
+            wait = self._chat_ready.get(chat_id, 0) - time.monotonic()
+            if wait > 0:
+                await self.repo.outbox_postpone(message[0], time.time() + wait, attempt=False)
+                continue
+            await self.bucket.acquire()
+            await self._slots.acquire()
+            self._chat_ready[chat_id] = time.monotonic() + self.chat_interval
+            tasks.append(asyncio.create_task(self._deliver(message)))
+        await asyncio.gather(*tasks)
+        return len(batch)
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                processed = await self.drain()
+            except Exception as e:
+                logger.error(f"Ошибка отправки очереди сообщений: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stats(self):
+        return {"sent": self.sent, "failed": self.failed, "throttled": self.throttled}
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+
+from metrics import PAYMENTS, STOCK_OUTS
+
+
+logger = logging.getLogger(__name__)
+
+FINAL_FAILURE_STATUSES = ("canceled", "failed")
+
+
+class OrderService:
+    """Подтверждение платежей: кнопка «Проверить», уведомления ЮKassa и сверка в фоне.
+
+    Все три пути сходятся в apply_status(), а выдача товара идемпотентна
+    (repository.fulfil_payment), поэтому заказ исполняется ровно один раз.
+    on_fulfilled(order) вызывается, когда заказ закрыт не из чата
+    пользователя (уведомление или фоновая сверка).
+    """
+
+    def __init__(self, repo, gateway, catalog, on_fulfilled, check_interval=5, reservation_ttl=900,
+                 reconcile_interval=30, max_reconcile_interval=3600):
+        self.repo = repo
+        self.gateway = gateway
+        self.catalog = catalog
+        self.on_fulfilled = on_fulfilled
+        self.check_interval = check_interval
+        self.reservation_ttl = reservation_ttl
+        self.reconcile_interval = reconcile_interval
+        self.max_reconcile_interval = max_reconcile_interval
+
+    async def reserve(self, user_id, product_id):
+        """Зарезервировать единицу товара до оплаты. Возвращает id резерва или None."""
+        hold = await self.repo.hold_unit(user_id, product_id, self.reservation_ttl)
+        if hold is None:
+            STOCK_OUTS.inc("reserve")
+            return None
+        reservation_id, change = hold
+        self.catalog.product_changed(*change)
+        return reservation_id
+
+    async def release(self, reservation_id=None, payment_id=None):
+        if reservation_id is not None:
+            released = await self.repo.release_reservation(reservation_id)
+        else:
+            released = await self.repo.release_payment_reservation(payment_id)
+        for change in released:
+            self.catalog.product_changed(*change)
+
+    async def apply_status(self, payment):
+        payment_id = payment["id"]
+        if payment["status"] == "succeeded":
+            changed, order, changes = await self.repo.fulfil_payment(payment_id)
+            for change in changes:
+                self.catalog.product_changed(*change)
+            if changed:
+                PAYMENTS.inc(order.status)
+                if order.status == "sold_out":
+                    STOCK_OUTS.inc("payment")
+            return changed, order
+        changed = False
+        if payment["status"] in FINAL_FAILURE_STATUSES:
+            changed, released = await self.repo.set_payment_status(payment_id, "canceled")
+            for change in released:
+                self.catalog.product_changed(*change)
+        order = await self.repo.get_order(payment_id)
+        if changed:
+            PAYMENTS.inc("canceled")
+        return changed, order
+
+    async def refresh(self, payment_id):
+        """Статус заказа для кнопки «Проверить платеж».
+
+        ЮKassa опрашивается не чаще раза в check_interval секунд на платёж,
+        остальные нажатия отвечают из базы.
+        """
+        if not await self.repo.claim_payment_check(payment_id, self.check_interval):
+            return await self.repo.get_order(payment_id)
+        payment = await self.gateway.get_payment(payment_id)
+        _, order = await self.apply_status(payment)
+        return order
+
+    async def sync(self, payment_id):
+        payment = await self.gateway.get_payment(payment_id)
+        changed, order = await self.apply_status(payment)
+        if changed and order.status != "canceled":
+            await self.on_fulfilled(order)
+        return order
+
+    async def handle_notification(self, notification):
+        """Уведомление ЮKassa. Телу не доверяем: статус перечитывается через API."""
+        payment_id = notification["object"]["id"]
+        order = await self.repo.get_order(payment_id)
+        if order is None or order.status != "pending":
+            return order
+        return await self.sync(payment_id)
+
+    async def reconcile(self, batch_size=50, concurrency=5):
+        """Сверить с ЮKassa ожидающие платежи, которым пора (см. get_pending_payments)."""
+        payment_ids = await self.repo.get_pending_payments(
+            self.reconcile_interval, self.max_reconcile_interval, batch_size
+        )
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def check(payment_id):
+            async with semaphore:
+                if not await self.repo.claim_payment_check(payment_id, self.check_interval):
+                    return
+                try:
+                    await self.sync(payment_id)
+                except Exception as e:
+                    logger.error(f"Ошибка сверки платежа {payment_id}: {e}")
+
+        await asyncio.gather(*(check(payment_id) for payment_id in payment_ids))
+        return len(payment_ids)
+
+    async def run_reconciler(self, batch_size=50):
+        while True:
+            try:
+                await self.reconcile(batch_size)
+            except Exception as e:
+                logger.error(f"Ошибка фоновой сверки платежей: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    async def run_reservation_sweeper(self, interval=30, batch_size=500):
+        """Возвращать на склад резервы, которые не оплатили за reservation_ttl.
+
+        Если такой платёж всё же пройдёт, fulfil_payment спишет единицу заново.
+        """
+        while True:
+            try:
+                released = await self.repo.release_expired_reservations(batch_size)
+                for change in released:
+                    self.catalog.product_changed(*change)
+                if released:
+                    logger.info(f"Снято просроченных резервов: {len(released)}")
+            except Exception as e:
+                logger.error(f"Ошибка снятия резервов: {e}")
+                released = []
+            if len(released) < batch_size:
+                await asyncio.sleep(interval)
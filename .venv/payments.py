@@ -0,0 +1,104 @@
+import asyncio
+import base64
+import logging
+import random
+import time
+import uuid
+
+import aiohttp
+
+from metrics import observe_yookassa
+
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class PaymentError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class YooKassaGateway:
+    """Асинхронный клиент API ЮKassa.
+
+    Держит одну keep-alive сессию на весь процесс, ограничивает время каждого
+    вызова и повторяет временные ошибки с экспоненциальной задержкой. Создание
+    платежа повторяется с тем же Idempotence-Key, поэтому повтор не создаст
+    второй платёж.
+    """
+
+    def __init__(self, shop_id, secret_key, base_url="https://api.yookassa.ru/v3",
+                 timeout=10, max_retries=3, backoff=0.5, pool_size=20):
+        self.shop_id = shop_id
+        self.secret_key = secret_key
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        credentials = base64.b64encode(f"{shop_id}:{secret_key}".encode()).decode()
+        self._headers = {"Authorization": f"Basic {credentials}"}
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers=self._headers,
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60, ttl_dns_cache=300),
+                raise_for_status=False
+            )
+        return self._session
+
+    async def _request(self, operation, method, path, payload=None, idempotence_key=None):
+        headers = {"Idempotence-Key": idempotence_key} if idempotence_key else None
+        url = f"{self.base_url}{path}"
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff * 2 ** attempt * (0.5 + random.random())
+            started = time.perf_counter()
+            try:
+                async with self._get_session().request(method, url, json=payload, headers=headers) as response:
+                    if response.status < 400:
+                        result = await response.json()
+                        observe_yookassa(operation, time.perf_counter() - started, "ok")
+                        return result
+                    text = await response.text()
+                    observe_yookassa(operation, time.perf_counter() - started, str(response.status))
+                    if response.status not in RETRY_STATUSES or attempt == self.max_retries:
+                        raise PaymentError(f"ЮKassa вернула {response.status}: {text}", response.status)
+                    retry_after = response.headers.get("Retry-After")
+                    if retry_after and retry_after.isdigit():
+                        delay = max(delay, int(retry_after))
+                    logger.warning(f"ЮKassa {method} {path}: {response.status}, повтор через {delay:.2f} с")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                outcome = "timeout" if isinstance(e, asyncio.TimeoutError) else "network"
+                observe_yookassa(operation, time.perf_counter() - started, outcome)
+                if attempt == self.max_retries:
+                    raise PaymentError(f"ЮKassa недоступна: {e!r}") from e
+                logger.warning(f"ЮKassa {method} {path}: {e!r}, повтор через {delay:.2f} с")
+            await asyncio.sleep(delay)
+
+    async def create_payment(self, amount, description, metadata, return_url, idempotence_key=None):
+        return await self._request("create_payment", "POST", "/payments", {
+            "amount": {
+                "value": str(amount),
+                "currency": "RUB"
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": return_url
+            },
+            "description": description,
+            "metadata": metadata,
+            "capture": True
+        }, idempotence_key or str(uuid.uuid4()))
+
+    async def get_payment(self, payment_id):
+        return await self._request("get_payment", "GET", f"/payments/{payment_id}")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
@@ -0,0 +1,519 @@
+import time
+from collections import namedtuple
+
+
+Order = namedtuple("Order", "payment_id user_id product_id status purchase_id name promo_code category_id")
+
+
+class ShopRepository:
+    """Все запросы магазина к базе, выполняются через пул Database."""
+
+    def __init__(self, db):
+        self.db = db
+        # Пользователи, уже записанные в users этим процессом: /start не пишет в базу повторно
+        self._registered = set()
+
+    async def get_categories(self, include_empty=False):
+        """Категории, в которых есть товары (или товары в наличии): [(id, name)]."""
+        condition = "" if include_empty else " AND p.stock > 0"
+        return await self.db.fetchall(
+            "SELECT c.id, c.name FROM categories c "
+            f"WHERE EXISTS (SELECT 1 FROM products p WHERE p.category_id = c.id{condition}) "
+            "ORDER BY c.id"
+        )
+
+    async def get_empty_categories(self):
+        return await self.db.fetchall('''
+            SELECT c.id, c.name
+            FROM categories c
+            JOIN products p ON p.category_id = c.id
+            GROUP BY c.id
+            HAVING MAX(p.stock) <= 0
+            ORDER BY c.id
+        ''')
+
+    async def get_category_products(self, category_id):
+        return await self.db.fetchall(
+            "SELECT id, name, price, stock FROM products WHERE category_id = ? ORDER BY id",
+            (category_id,)
+        )
+
+    async def get_category_page(self, category_id, after_id=0, before_id=None, limit=10):
+        """Страница товаров категории по ключу id, без OFFSET.
+
+        Возвращает (products, has_prev, has_next).
+        """
+        if before_id is None:
+            products = await self.db.fetchall(
+                "SELECT id, name, price, stock FROM products WHERE category_id = ? AND id > ? "
+                "ORDER BY id LIMIT ?",
+                (category_id, after_id, limit + 1)
+            )
+            return products[:limit], after_id > 0, len(products) > limit
+        products = await self.db.fetchall(
+            "SELECT id, name, price, stock FROM products WHERE category_id = ? AND id < ? "
+            "ORDER BY id DESC LIMIT ?",
+            (category_id, before_id, limit + 1)
+        )
+        return products[:limit][::-1], len(products) > limit, True
+
+    async def get_product(self, product_id):
+        return await self.db.fetchone(
+            "SELECT name, description, price, stock FROM products WHERE id = ?",
+            (product_id,)
+        )
+
+    async def get_purchase_history(self, user_id, older_than=None, newer_than=None, limit=10):
+        """Страница истории покупок, от новых к старым.
+
+        Курсор — id покупки на границе страницы; сравнение идёт по
+        (purchase_date, id) и использует индекс idx_purchases_user_date.
+        Возвращает (purchases, has_newer, has_older).
+        """
+        query = '''
+            SELECT pu.id, p.name, c.name, p.price, pu.purchase_date
+            FROM purchases pu
+            JOIN products p ON pu.product_id = p.id
+            JOIN categories c ON p.category_id = c.id
+            WHERE pu.user_id = ? {condition}
+            ORDER BY pu.purchase_date {order}, pu.id {order}
+            LIMIT ?
+        '''
+        cursor_row = "(SELECT purchase_date, id FROM purchases WHERE id = ?)"
+        if newer_than is not None:
+            purchases = await self.db.fetchall(
+                query.format(condition=f"AND (pu.purchase_date, pu.id) > {cursor_row}", order="ASC"),
+                (user_id, newer_than, limit + 1)
+            )
+            return purchases[:limit][::-1], len(purchases) > limit, True
+        if older_than is not None:
+            purchases = await self.db.fetchall(
+                query.format(condition=f"AND (pu.purchase_date, pu.id) < {cursor_row}", order="DESC"),
+                (user_id, older_than, limit + 1)
+            )
+            return purchases[:limit], True, len(purchases) > limit
+        purchases = await self.db.fetchall(
+            query.format(condition="", order="DESC"),
+            (user_id, limit + 1)
+        )
+        return purchases[:limit], False, len(purchases) > limit
+
+    async def get_stock_report(self):
+        return await self.db.fetchall('''
+            SELECT c.name, p.name, p.stock
+            FROM products p
+            JOIN categories c ON p.category_id = c.id
+            ORDER BY c.id, p.id
+        ''')
+
+    async def add_product(self, category, name, description, price, promo_code, stock, codes=()):
+        """Добавить товар, создав категорию при необходимости.
+
+        codes — пул уникальных промокодов, по одному на единицу товара.
+        Возвращает (product_id, category_id).
+        """
+        def _add(conn):
+            conn.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (category,))
+            category_id = conn.execute("SELECT id FROM categories WHERE name = ?", (category,)).fetchone()[0]
+            cursor = conn.execute(
+                "INSERT INTO products (category_id, name, description, price, promo_code, stock) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (category_id, name, description, price, promo_code, stock)
+            )
+            product_id = cursor.lastrowid
+            conn.executemany(
+                "INSERT INTO promo_codes (product_id, code) VALUES (?, ?)",
+                [(product_id, code) for code in codes]
+            )
+            _bump_catalog_version(conn)
+            return product_id, category_id
+        return await self.db.transaction(_add)
+
+    async def restock_category(self, category_id, amount):
+        """Пополнить товары категории с общим промокодом.
+
+        Товары с пулом кодов пропускаются: их остаток равен числу свободных
+        кодов, и без новых кодов пополнить его нельзя.
+        Возвращает (restocked, skipped) — число пополненных и пропущенных товаров.
+        """
+        def _restock(conn):
+            restocked = conn.execute(
+                "UPDATE products SET stock = stock + ? WHERE category_id = ? "
+                "AND NOT EXISTS (SELECT 1 FROM promo_codes pc WHERE pc.product_id = products.id)",
+                (amount, category_id)
+            ).rowcount
+            skipped = conn.execute(
+                "SELECT COUNT(*) FROM products p WHERE p.category_id = ? "
+                "AND EXISTS (SELECT 1 FROM promo_codes pc WHERE pc.product_id = p.id)",
+                (category_id,)
+            ).fetchone()[0]
+            if restocked:
+                _bump_catalog_version(conn)
+            return restocked, skipped
+        return await self.db.transaction(_restock)
+
+    async def delete_product(self, product_id):
+        def _delete(conn):
+            conn.execute("DELETE FROM purchases WHERE product_id = ?", (product_id,))
+            conn.execute("DELETE FROM reservations WHERE product_id = ?", (product_id,))
+            conn.execute("DELETE FROM promo_codes WHERE product_id = ?", (product_id,))
+            conn.execute("DELETE FROM stock_subscriptions WHERE product_id = ?", (product_id,))
+            conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+            _bump_catalog_version(conn)
+        await self.db.transaction(_delete)
+
+    async def get_catalog_version(self):
+        return (await self.db.fetchone("SELECT version FROM catalog_version WHERE id = 1"))[0]
+
+    async def hold_unit(self, user_id, product_id, ttl):
+        """Атомарно зарезервировать единицу товара (и код из пула) на ttl секунд.
+
+        У покупателя не больше одного резерва на товар: если он уже есть
+        (повторное нажатие «Оплатить»), продлевается он, а не занимается
+        новая единица.
+        Возвращает (reservation_id, change) или None, если товар закончился;
+        change — изменение остатка, см. _stock_change().
+        """
+        def _hold(conn):
+            held = conn.execute(
+                "SELECT id FROM reservations WHERE user_id = ? AND product_id = ? AND status = 'held'",
+                (user_id, product_id)
+            ).fetchone()
+            if held is not None:
+                conn.execute("UPDATE reservations SET expires_at = ? WHERE id = ?", (time.time() + ttl, held[0]))
+                return held[0], _stock_change(conn, product_id, 0)
+            code_id = _take_unit(conn, product_id)
+            if code_id is False:
+                return None
+            cursor = conn.execute(
+                "INSERT INTO reservations (product_id, user_id, code_id, expires_at) VALUES (?, ?, ?, ?)",
+                (product_id, user_id, code_id, time.time() + ttl)
+            )
+            return cursor.lastrowid, _stock_change(conn, product_id, -1)
+        return await self.db.transaction(_hold)
+
+    async def release_reservation(self, reservation_id):
+        return await self.db.transaction(_release_held, "r.id = ?", (reservation_id,))
+
+    async def release_payment_reservation(self, payment_id):
+        """Пользователь отменил покупку: снять резерв платежа.
+
+        Платёж остаётся pending (его ещё могут оплатить по ссылке), но
+        помечается canceled_by_user, и фоновая сверка опрашивает его реже.
+        """
+        def _release(conn):
+            conn.execute(
+                "UPDATE payments SET canceled_by_user = 1 WHERE payment_id = ? AND status = 'pending'",
+                (payment_id,)
+            )
+            return _release_held(conn, "r.payment_id = ?", (payment_id,))
+        return await self.db.transaction(_release)
+
+    async def release_expired_reservations(self, limit=500):
+        """Вернуть на склад просроченные резервы. Возвращает список изменений остатка."""
+        return await self.db.transaction(
+            _release_held, "r.expires_at <= ? ORDER BY r.expires_at LIMIT ?", (time.time(), limit)
+        )
+
+    async def create_payment_record(self, payment_id, user_id, product_id, amount, reservation_id=None):
+        def _create(conn):
+            conn.execute(
+                "INSERT INTO payments (payment_id, user_id, product_id, amount) VALUES (?, ?, ?, ?)",
+                (payment_id, user_id, product_id, amount)
+            )
+            if reservation_id is not None:
+                conn.execute(
+                    "UPDATE reservations SET payment_id = ? WHERE id = ?",
+                    (payment_id, reservation_id)
+                )
+        await self.db.transaction(_create)
+
+    async def get_order(self, payment_id):
+        return await self.db.run(_select_order, payment_id)
+
+    async def claim_payment_check(self, payment_id, interval):
+        """Отметить проверку платежа у провайдера, если прошлая была давно.
+
+        Возвращает True, если вызывающий должен спросить статус у ЮKassa.
+        """
+        rowcount, _ = await self.db.execute(
+            "UPDATE payments SET checked_at = CURRENT_TIMESTAMP "
+            "WHERE payment_id = ? AND status = 'pending' "
+            "AND (checked_at IS NULL OR checked_at <= datetime('now', ?))",
+            (payment_id, f"-{interval} seconds")
+        )
+        return rowcount == 1
+
+    async def get_pending_payments(self, interval, max_interval, limit):
+        """Ожидающие платежи, которые пора сверить с ЮKassa.
+
+        Пауза между проверками платежа — четверть его возраста, но не меньше
+        interval и не больше max_interval секунд, поэтому брошенные платежи
+        опрашиваются всё реже. Отменённые пользователем — вчетверо реже.
+        """
+        rows = await self.db.fetchall('''
+            SELECT payment_id FROM payments
+            WHERE status = 'pending'
+            AND (julianday('now') - julianday(COALESCE(checked_at, created_at))) * 86400
+                >= MIN(?, MAX(?, (julianday('now') - julianday(created_at)) * 86400 / 4))
+                   * (1 + 3 * canceled_by_user)
+            ORDER BY COALESCE(checked_at, created_at) LIMIT ?
+        ''', (max_interval, interval, limit))
+        return [row[0] for row in rows]
+
+    async def set_payment_status(self, payment_id, status):
+        """Перевести ожидающий платёж в конечный статус и снять его резерв.
+
+        Возвращает (changed, changes): changed=True, если статус изменился,
+        changes — изменения остатка от снятого резерва.
+        """
+        def _set_status(conn):
+            cursor = conn.execute(
+                "UPDATE payments SET status = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE payment_id = ? AND status = 'pending'",
+                (status, payment_id)
+            )
+            if cursor.rowcount == 0:
+                return False, []
+            return True, _release_held(conn, "r.payment_id = ?", (payment_id,))
+        return await self.db.transaction(_set_status)
+
+    async def fulfil_payment(self, payment_id):
+        """Идемпотентно выдать товар по оплаченному платежу.
+
+        Возвращает (changed, order, changes): changed=True только у того вызова,
+        который перевёл платёж из pending в succeeded или sold_out. Если резерв
+        платежа уже истёк, единица товара списывается заново, и это изменение
+        остатка попадает в changes.
+        """
+        def _fulfil(conn):
+            payment = conn.execute(
+                "SELECT user_id, product_id, status FROM payments WHERE payment_id = ?",
+                (payment_id,)
+            ).fetchone()
+            if not payment or payment[2] != 'pending':
+                return False, _select_order(conn, payment_id), []
+            user_id, product_id, _ = payment
+            reservation = conn.execute(
+                "SELECT id, code_id, status FROM reservations WHERE payment_id = ?",
+                (payment_id,)
+            ).fetchone()
+            changes = []
+            if reservation and reservation[2] == 'held':
+                reservation_id, code_id, _ = reservation
+            else:
+                code_id = _take_unit(conn, product_id)
+                reservation_id = reservation[0] if reservation else None
+                if code_id is not False:
+                    changes.append(_stock_change(conn, product_id, -1))
+            if code_id is False:
+                conn.execute(
+                    "UPDATE payments SET status = 'sold_out', updated_at = CURRENT_TIMESTAMP WHERE payment_id = ?",
+                    (payment_id,)
+                )
+                return True, _select_order(conn, payment_id), changes
+            if reservation_id is None:
+                cursor = conn.execute(
+                    "INSERT INTO reservations (product_id, user_id, payment_id, code_id, status, expires_at) "
+                    "VALUES (?, ?, ?, ?, 'purchased', ?)",
+                    (product_id, user_id, payment_id, code_id, time.time())
+                )
+                reservation_id = cursor.lastrowid
+            conn.execute(
+                "UPDATE reservations SET status = 'purchased', code_id = ? WHERE id = ?",
+                (code_id, reservation_id)
+            )
+            if code_id is not None:
+                conn.execute("UPDATE promo_codes SET status = 'sold' WHERE id = ?", (code_id,))
+            cursor = conn.execute(
+                "INSERT INTO purchases (user_id, product_id) VALUES (?, ?)",
+                (user_id, product_id)
+            )
+            conn.execute(
+                "UPDATE payments SET status = 'succeeded', purchase_id = ?, updated_at = CURRENT_TIMESTAMP "
+                "WHERE payment_id = ?",
+                (cursor.lastrowid, payment_id)
+            )
+            return True, _select_order(conn, payment_id), changes
+        return await self.db.transaction(_fulfil)
+
+    async def register_user(self, user_id):
+        """Записать пользователя в users; /start после блокировки бота снова включает рассылки."""
+        if user_id in self._registered:
+            return
+        await self.db.execute(
+            "INSERT INTO users (user_id) VALUES (?) ON CONFLICT (user_id) DO UPDATE SET blocked = 0",
+            (user_id,)
+        )
+        self._registered.add(user_id)
+
+    async def subscribe_restock(self, user_id, product_id):
+        """Подписать пользователя на поступление товара. Возвращает False, если уже подписан."""
+        def _subscribe(conn):
+            conn.execute(
+                "INSERT INTO users (user_id) VALUES (?) ON CONFLICT (user_id) DO UPDATE SET blocked = 0",
+                (user_id,)
+            )
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO stock_subscriptions (product_id, user_id) VALUES (?, ?)",
+                (product_id, user_id)
+            )
+            return cursor.rowcount == 1
+        subscribed = await self.db.transaction(_subscribe)
+        self._registered.add(user_id)
+        return subscribed
+
+    async def queue_restock_notifications(self, category_id, text):
+        """Поставить в очередь уведомления подписчикам товаров категории, которые снова в наличии.
+
+        text — шаблон с {name}. Подписка одноразовая и снимается в той же
+        транзакции. Возвращает число сообщений.
+        """
+        def _queue(conn):
+            products = conn.execute('''
+                SELECT p.id, p.name FROM products p
+                WHERE p.category_id = ? AND p.stock > 0
+                AND EXISTS (SELECT 1 FROM stock_subscriptions s WHERE s.product_id = p.id)
+            ''', (category_id,)).fetchall()
+            queued = 0
+            for product_id, name in products:
+                queued += conn.execute(
+                    "INSERT INTO outbox (chat_id, text, product_id) "
+                    "SELECT s.user_id, ?, s.product_id FROM stock_subscriptions s "
+                    "JOIN users u ON u.user_id = s.user_id "
+                    "WHERE s.product_id = ? AND u.blocked = 0 ORDER BY s.created_at",
+                    (text.format(name=name), product_id)
+                ).rowcount
+                conn.execute("DELETE FROM stock_subscriptions WHERE product_id = ?", (product_id,))
+            return queued
+        return await self.db.transaction(_queue)
+
+    async def queue_broadcast(self, text):
+        """Поставить рассылку всем, кто не заблокировал бота. Возвращает число сообщений."""
+        rowcount, _ = await self.db.execute(
+            "INSERT INTO outbox (chat_id, text) SELECT user_id, ? FROM users WHERE blocked = 0",
+            (text,)
+        )
+        return rowcount
+
+    async def get_outbox_batch(self, limit):
+        """Сообщения, которые пора отправить: [(id, chat_id, text, product_id, attempts)]."""
+        return await self.db.fetchall(
+            "SELECT id, chat_id, text, product_id, attempts FROM outbox "
+            "WHERE status = 'pending' AND not_before <= ? ORDER BY not_before, id LIMIT ?",
+            (time.time(), limit)
+        )
+
+    async def count_outbox_pending(self):
+        return (await self.db.fetchone("SELECT COUNT(*) FROM outbox WHERE status = 'pending'"))[0]
+
+    async def outbox_sent(self, message_id):
+        await self.db.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    async def outbox_postpone(self, message_id, not_before, error=None, attempt=True):
+        await self.db.execute(
+            "UPDATE outbox SET not_before = ?, error = ?, attempts = attempts + ? WHERE id = ?",
+            (not_before, error, int(attempt), message_id)
+        )
+
+    async def outbox_failed(self, message_id, error, blocked_chat_id=None):
+        """Сообщение не будет доставлено.
+
+        blocked_chat_id — пользователь заблокировал бота: остальные его
+        сообщения и подписки снимаются, в рассылки он больше не попадает.
+        """
+        def _failed(conn):
+            conn.execute(
+                "UPDATE outbox SET status = 'failed', error = ?, attempts = attempts + 1 WHERE id = ?",
+                (error, message_id)
+            )
+            if blocked_chat_id is not None:
+                conn.execute("UPDATE users SET blocked = 1 WHERE user_id = ?", (blocked_chat_id,))
+                conn.execute("DELETE FROM stock_subscriptions WHERE user_id = ?", (blocked_chat_id,))
+                conn.execute(
+                    "UPDATE outbox SET status = 'failed', error = ? WHERE chat_id = ? AND status = 'pending'",
+                    (error, blocked_chat_id)
+                )
+        await self.db.transaction(_failed)
+        if blocked_chat_id is not None:
+            # Следующий /start должен снять блокировку в базе
+            self._registered.discard(blocked_chat_id)
+
+
+def _select_order(conn, payment_id):
+    row = conn.execute('''
+        SELECT pa.payment_id, pa.user_id, pa.product_id, pa.status, pa.purchase_id,
+               p.name, COALESCE(pc.code, p.promo_code), p.category_id
+        FROM payments pa
+        LEFT JOIN products p ON pa.product_id = p.id
+        LEFT JOIN reservations r ON r.payment_id = pa.payment_id
+        LEFT JOIN promo_codes pc ON pc.id = r.code_id
+        WHERE pa.payment_id = ?
+    ''', (payment_id,)).fetchone()
+    return Order(*row) if row else None
+
+
+def _take_unit(conn, product_id):
+    """Списать единицу со склада и занять свободный код из пула товара.
+
+    Возвращает id кода, None для товара без пула (общий promo_code)
+    или False, если товар закончился.
+    """
+    has_pool = conn.execute(
+        "SELECT EXISTS (SELECT 1 FROM promo_codes WHERE product_id = ?)",
+        (product_id,)
+    ).fetchone()[0]
+    code_id = None
+    if has_pool:
+        code = conn.execute(
+            "SELECT id FROM promo_codes WHERE product_id = ? AND status = 'available' LIMIT 1",
+            (product_id,)
+        ).fetchone()
+        if code is None:
+            return False
+        code_id = code[0]
+    cursor = conn.execute(
+        "UPDATE products SET stock = stock - 1 WHERE id = ? AND stock > 0",
+        (product_id,)
+    )
+    if cursor.rowcount == 0:
+        return False
+    if code_id is not None:
+        conn.execute("UPDATE promo_codes SET status = 'held' WHERE id = ?", (code_id,))
+    return code_id
+
+
+def _bump_catalog_version(conn):
+    conn.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1")
+
+
+def _stock_change(conn, product_id, delta):
+    """Изменение остатка для инвалидации кэша каталога.
+
+    Возвращает (product_id, category_id, crossed_zero): crossed_zero=True,
+    если после изменения на delta товар появился в наличии или закончился.
+    Такой переход виден и другим процессам через catalog_version.
+    """
+    row = conn.execute("SELECT category_id, stock FROM products WHERE id = ?", (product_id,)).fetchone()
+    if row is None:
+        return product_id, None, False
+    category_id, stock = row
+    crossed_zero = (stock > 0) != (stock - delta > 0)
+    if crossed_zero:
+        _bump_catalog_version(conn)
+    return product_id, category_id, crossed_zero
+
+
+def _release_held(conn, condition, params):
+    reservations = conn.execute(
+        f"SELECT r.id, r.product_id, r.code_id FROM reservations r WHERE r.status = 'held' AND {condition}",
+        params
+    ).fetchall()
+    changes = []
+    for reservation_id, product_id, code_id in reservations:
+        conn.execute("UPDATE reservations SET status = 'released' WHERE id = ?", (reservation_id,))
+        conn.execute("UPDATE products SET stock = stock + 1 WHERE id = ?", (product_id,))
+        if code_id is not None:
+            conn.execute("UPDATE promo_codes SET status = 'available' WHERE id = ?", (code_id,))
+        changes.append(_stock_change(conn, product_id, 1))
+    return changes
@@ -0,0 +1,40 @@
+import json
+import logging
+
+from aiohttp import web
+
+from metrics_middleware import metrics_handler
+
+
+logger = logging.getLogger(__name__)
+
+
+async def yookassa_notification(request):
+    try:
+        notification = await request.json()
+        notification["object"]["id"]
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return web.Response(status=400)
+    try:
+        await request.app["orders"].handle_notification(notification)
+    except Exception as e:
+        # Ответ не 200 — ЮKassa повторит уведомление позже
+        logger.error(f"Ошибка обработки уведомления ЮKassa: {e}")
+        return web.Response(status=500)
+    return web.Response(status=200)
+
+
+def create_app(orders):
+    app = web.Application()
+    app["orders"] = orders
+    app.router.add_post("/yookassa/notifications", yookassa_notification)
+    app.router.add_get("/metrics", metrics_handler)
+    return app
+
+
+async def start_app(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"HTTP-сервер запущен на {host}:{port}")
+    return runner
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в SQLite: переживает перезапуск и общее для всех процессов на одной машине.
+
+    Состояния, которые не менялись дольше ttl секунд, считаются пустыми
+    и удаляются фоновой очисткой (run_evictor). Таблицу fsm_states
+    создаёт миграция fsm_storage.
+    """
+
+    def __init__(self, db, ttl=86400, key_builder=None):
+        self.db = db
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        now = time.time()
+        await self.db.execute(
+            "INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET state = excluded.state, "
+            "data = CASE WHEN updated_at > ? THEN data ELSE '{}' END, updated_at = excluded.updated_at",
+            (self.key_builder.build(key), state, now, now - self.ttl)
+        )
+
+    async def get_state(self, key):
+        row = await self.db.fetchone(
+            "SELECT state FROM fsm_states WHERE key = ? AND updated_at > ?",
+            (self.key_builder.build(key), time.time() - self.ttl)
+        )
+        return row[0] if row else None
+
+    async def set_data(self, key, data):
+        now = time.time()
+        await self.db.execute(
+            "INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET data = excluded.data, "
+            "state = CASE WHEN updated_at > ? THEN state END, updated_at = excluded.updated_at",
+            (self.key_builder.build(key), json.dumps(dict(data), ensure_ascii=False), now, now - self.ttl)
+        )
+
+    async def get_data(self, key):
+        row = await self.db.fetchone(
+            "SELECT data FROM fsm_states WHERE key = ? AND updated_at > ?",
+            (self.key_builder.build(key), time.time() - self.ttl)
+        )
+        return json.loads(row[0]) if row else {}
+
+    async def evict_expired(self):
+        rowcount, _ = await self.db.execute(
+            "DELETE FROM fsm_states WHERE updated_at <= ? OR (state IS NULL AND data = '{}')",
+            (time.time() - self.ttl,)
+        )
+        return rowcount
+
+    async def run_evictor(self, interval=3600):
+        while True:
+            try:
+                evicted = await self.evict_expired()
+                if evicted:
+                    logger.info(f"Удалено устаревших состояний FSM: {evicted}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний FSM: {e}")
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        pass
+
+
+def create_storage(db, redis_url=None, ttl=86400):
+    """SQLite по умолчанию, Redis — если задан redis_url (нужен пакет redis)."""
+    if redis_url:
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(redis_url, state_ttl=ttl, data_ttl=ttl)
+    return SQLiteStorage(db, ttl)
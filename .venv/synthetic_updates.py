@@ -0,0 +1,43 @@
+"""Синтетические апдейты Telegram в виде JSON для бенчмарков."""
+import itertools
+import time
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat(user_id):
+    return {"id": user_id, "type": "private"}
+
+
+def message_update(user_id, text):
+    message = {
+        "message_id": next(_update_ids),
+        "date": int(time.time()),
+        "chat": _chat(user_id),
+        "from": _user(user_id),
+        "text": text
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(_update_ids), "message": message}
+
+
+def callback_update(user_id, data):
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id),
+        "from": _user(user_id),
+        "chat_instance": str(user_id),
+        "data": data,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "text": "..."
+        }
+    }}
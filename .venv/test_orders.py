@@ -0,0 +1,82 @@
+"""Подтверждение оплаты тремя путями сразу исполняет заказ ровно один раз.
+
+Запуск: python -m pytest test_orders.py
+"""
+import asyncio
+import os
+import socket
+import sqlite3
+
+from catalog import CatalogCache
+from db import Database
+from fake_yookassa import FakeYooKassa
+from migrations import migrate
+from orders import OrderService
+from payments import YooKassaGateway
+from repository import ShopRepository
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def confirm_concurrently(path, paths, rounds=10):
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrate(conn)
+    conn.close()
+    db = Database(path)
+    repo = ShopRepository(db)
+    fake = FakeYooKassa(latency=0.01)
+    gateway = YooKassaGateway("test", "test", await fake.start(port=free_port()), backoff=0)
+    fulfilled = []
+
+    async def on_fulfilled(order):
+        fulfilled.append(order.payment_id)
+
+    # Нулевые интервалы: каждый путь действительно идёт в ЮKassa
+    orders = OrderService(repo, gateway, CatalogCache(), on_fulfilled, check_interval=0, reconcile_interval=0)
+    codes = [f"CODE-{i}" for i in range(rounds)]
+    product_id, _ = await repo.add_product("Тест", "Товар", "", 100, None, rounds, codes)
+    confirm = {
+        "refresh": orders.refresh,
+        "notification": lambda payment_id: orders.handle_notification({"object": {"id": payment_id}}),
+        "reconcile": lambda payment_id: orders.reconcile()
+    }
+    payment_ids = []
+    try:
+        for user_id in range(rounds):
+            reservation_id = await orders.reserve(user_id, product_id)
+            payment = await gateway.create_payment(100, "Товар", {}, "https://t.me/test")
+            await repo.create_payment_record(payment["id"], user_id, product_id, 100, reservation_id)
+            fake.set_status(payment["id"], "succeeded")
+            await asyncio.gather(*(confirm[name](payment["id"]) for name in paths))
+            payment_ids.append(payment["id"])
+        purchases = (await db.fetchone("SELECT COUNT(*) FROM purchases"))[0]
+        sold = (await db.fetchone("SELECT COUNT(*) FROM promo_codes WHERE status = 'sold'"))[0]
+        statuses = {(await repo.get_order(payment_id)).status for payment_id in payment_ids}
+        return payment_ids, fulfilled, purchases, sold, statuses
+    finally:
+        await gateway.close()
+        await fake.close()
+        db.close()
+
+
+def test_three_paths_fulfil_once(tmp_path):
+    payment_ids, fulfilled, purchases, sold, statuses = asyncio.run(confirm_concurrently(
+        os.path.join(tmp_path, "shop.db"), ("refresh", "notification", "reconcile")
+    ))
+    assert purchases == sold == len(payment_ids)
+    assert statuses == {"succeeded"}
+    # Если заказ закрыла кнопка «Проверить», пользователь видит его в чате и уведомление не нужно
+    assert all(fulfilled.count(payment_id) <= 1 for payment_id in payment_ids)
+
+
+def test_background_paths_notify_once(tmp_path):
+    payment_ids, fulfilled, purchases, sold, statuses = asyncio.run(confirm_concurrently(
+        os.path.join(tmp_path, "shop.db"), ("notification", "reconcile")
+    ))
+    assert purchases == sold == len(payment_ids)
+    assert statuses == {"succeeded"}
+    assert sorted(fulfilled) == sorted(payment_ids)
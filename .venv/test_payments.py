@@ -0,0 +1,63 @@
+"""Повторы и ошибки клиента ЮKassa против FakeYooKassa.
+
+Запуск: python -m pytest test_payments.py
+"""
+import asyncio
+import socket
+
+import pytest
+
+from fake_yookassa import FakeYooKassa
+from payments import PaymentError, YooKassaGateway
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def call(fake, operation, **gateway_options):
+    gateway = YooKassaGateway("test", "test", await fake.start(port=free_port()), backoff=0, **gateway_options)
+    try:
+        return await operation(gateway)
+    finally:
+        await gateway.close()
+        await fake.close()
+
+
+def create(gateway):
+    return gateway.create_payment(100, "Товар", {}, "https://t.me/test")
+
+
+def test_create_retries_with_same_idempotence_key():
+    fake = FakeYooKassa(fail_next=1)
+    payment = asyncio.run(call(fake, create))
+    assert fake.requests == 2
+    assert list(fake.payments) == [payment["id"]]
+    assert len(fake.received_keys) == 2 and len(set(fake.received_keys)) == 1
+
+
+def test_persistent_5xx_gives_up_after_max_retries():
+    fake = FakeYooKassa(fail_rate=1.0)
+    with pytest.raises(PaymentError) as error:
+        asyncio.run(call(fake, create, max_retries=2))
+    assert error.value.status == 503
+    assert fake.requests == 3
+    assert not fake.payments
+
+
+def test_client_error_is_not_retried():
+    fake = FakeYooKassa()
+    with pytest.raises(PaymentError) as error:
+        asyncio.run(call(fake, lambda gateway: gateway.get_payment("missing")))
+    assert error.value.status == 404
+    assert fake.requests == 1
+
+
+def test_timeout_raises_payment_error():
+    fake = FakeYooKassa(latency=1)
+    with pytest.raises(PaymentError) as error:
+        asyncio.run(call(fake, lambda gateway: gateway.get_payment("missing"), timeout=0.1, max_retries=1))
+    assert error.value.status is None
+    assert fake.requests == 2